@@ -0,0 +1,69 @@
+from dataclasses import dataclass, asdict
+from typing import Awaitable, Callable
+import asyncio, statistics, time
+
+@dataclass
+class BenchmarkResult:
+    name: str
+    iterations: int
+    concurrency: int
+    errors: int
+    p50_ms: float
+    p95_ms: float
+    p99_ms: float
+    mean_ms: float
+    throughput: float
+
+    def to_dict(self) -> dict:
+        return asdict(self)
+
+async def measure(name: str, func: Callable[[], Awaitable], iterations: int, concurrency: int = 1, warmup: int = 5) -> BenchmarkResult:
+    for _ in range(warmup):
+        await func()
+
+    latencies: list[float] = []
+    errors = 0
+    remaining = iterations
+
+    async def worker():
+        nonlocal remaining, errors
+        while remaining > 0:
+            remaining -= 1
+            start = time.perf_counter()
+            try:
+                await func()
+            except Exception:
+                errors += 1
+            latencies.append((time.perf_counter() - start) * 1000)
+
+    # Workers share the event loop, so concurrency measures how the loop copes with overlapping requests
+    started = time.perf_counter()
+    await asyncio.gather(*[worker() for _ in range(concurrency)])
+    elapsed = time.perf_counter() - started
+
+    percentiles = statistics.quantiles(latencies, n=100, method="inclusive") if len(latencies) > 1 else latencies * 99
+    return BenchmarkResult(
+        name = name,
+        iterations = iterations,
+        concurrency = concurrency,
+        errors = errors,
+        p50_ms = round(percentiles[49], 3),
+        p95_ms = round(percentiles[94], 3),
+        p99_ms = round(percentiles[98], 3),
+        mean_ms = round(statistics.fmean(latencies), 3),
+        throughput = round(iterations / elapsed, 1),
+    )
+
+def print_results(results: list[BenchmarkResult]):
+    print(f"{'benchmark':<32} {'iter':>6} {'conc':>5} {'err':>5} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'req/s':>9}")
+    for r in results:
+        print(f"{r.name:<32} {r.iterations:>6} {r.concurrency:>5} {r.errors:>5} {r.p50_ms:>9} {r.p95_ms:>9} {r.p99_ms:>9} {r.throughput:>9}")
+
+def print_comparison(results: list[BenchmarkResult], baseline: dict):
+    previous = { r["name"]: r for r in baseline.get("results", []) }
+    print(f"\nCompared with {baseline.get('commit', 'baseline')}")
+    print(f"{'benchmark':<32} {'p50 ms':>18} {'p99 ms':>18} {'req/s':>18}")
+    for r in results:
+        if (b := previous.get(r.name)) is None:
+            continue
+        print(f"{r.name:<32} {b['p50_ms']:>8} -> {r.p50_ms:<7} {b['p99_ms']:>8} -> {r.p99_ms:<7} {b['throughput']:>8} -> {r.throughput:<7}")
@@ -0,0 +1,153 @@
+from datetime import datetime, timezone
+import argparse, asyncio, io, json, os, subprocess
+
+from benchmarks.bench_utils import BenchmarkResult, measure, print_comparison, print_results
+
+BENCH_EMAIL = "benchmark@example.com"
+BENCH_PASSWORD = "benchmark-password"
+
+def configure_environment(db_url: str, db_name: str):
+    # Set before the application is imported, load_dotenv does not override existing variables
+    os.environ["DB_URL"] = db_url
+    os.environ["DB_NAME"] = db_name
+    os.environ["LOG_DB_URL"] = db_url
+    os.environ["LOG_DATABASE_NAME"] = f"{db_name}-logs"
+    os.environ["LOG_LEVEL"] = "ERROR"
+    os.environ["DB_INDEXES_BACKGROUND"] = "false"
+    # The sign-in benchmark repeats the same username, the limiter would reject most of it
+    os.environ["SIGN_IN_RATE_LIMIT_BACKEND"] = "none"
+    # The default secret of .env is not base32, the RFC 6238 test secret in base32 is used instead
+    os.environ["TOTP_SECRET"] = "GEZDGNBVGY3TQOJQGEZDGNBVGY3TQOJQ"
+
+def get_commit() -> str:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True).stdout.strip()
+    except Exception:
+        return "unknown"
+
+async def run_micro(iterations: int) -> list[BenchmarkResult]:
+    from src.main import container
+    from src.services.jwt_service import create_token, verify, verify_token
+
+    crypto = container.crypto_service()
+    totp = container.totp()
+    token_cache = container.token_cache()
+    results = []
+
+    token = await create_token({ "sub": BENCH_EMAIL, "name": "Benchmark", "roles": ["admin"] })
+    ciphertext = await crypto.encrypt_text(BENCH_EMAIL)
+    code = await totp.now()
+
+    async def verify_uncached():
+        token_cache.clear()
+        await verify_token(token)
+
+    results.append(await measure("create_token", lambda: create_token({ "sub": BENCH_EMAIL, "name": "Benchmark", "roles": ["admin"] }), iterations))
+    results.append(await measure("verify (jwt.decode)", lambda: verify(token), iterations))
+    results.append(await measure("verify_token (cached)", lambda: verify_token(token), iterations))
+    results.append(await measure("verify_token (uncached)", verify_uncached, iterations))
+    results.append(await measure("crypto.encrypt_text", lambda: crypto.encrypt_text(BENCH_EMAIL), iterations))
+    results.append(await measure("crypto.decrypt_text", lambda: crypto.decrypt_text(ciphertext), iterations))
+
+    async def verify_totp():
+        # Accepted codes are not accepted again, the replay cache is emptied to measure a successful verification
+        totp.used_codes.clear()
+        if not await totp.verify(code):
+            raise Exception("totp.verify rejected a valid code")
+
+    async def verify_totp_uncached():
+        totp.hashers.clear()
+        totp.used_codes.clear()
+        if not await totp.verify(code):
+            raise Exception("totp.verify rejected a valid code")
+
+    # A rejected code takes the error path, its timings would not be the ones of a verification
+    await verify_totp()
+
+    results.append(await measure("totp.verify", verify_totp, iterations))
+    results.append(await measure("totp.verify (uncached key)", verify_totp_uncached, iterations))
+    results.append(await measure("totp.verify (replayed)", lambda: totp.verify(code), iterations))
+    results.append(await measure("totp.verify (invalid)", lambda: totp.verify("00000000"), iterations))
+    return results
+
+async def seed(db, crypto):
+    from src.models.user_model import User
+    users = os.environ["DB_USERS_COLLECTION"]
+    await db[users].delete_many({})
+    await db["Products"].delete_many({})
+    await db[users].insert_one(User(
+        name = "Benchmark",
+        email = BENCH_EMAIL,
+        email_verified = True,
+        password = await crypto.get_psw_hash(BENCH_PASSWORD),
+        roles = ["admin"]).model_dump(exclude={"id"}))
+    await db[users].insert_many([{ "name": f"User{x}", "email": f"user{x}@example.com", "password": "", "roles": [] } for x in range(500)])
+    await db["Products"].insert_many([{ "name": f"Product{x}", "quantity": x + 1, "created_at": datetime.now() } for x in range(500)])
+
+def create_picture() -> bytes:
+    from PIL import Image
+    output = io.BytesIO()
+    Image.new("RGB", (512, 512), (30, 120, 200)).save(output, "PNG")
+    return output.getvalue()
+
+async def run_http(iterations: int, concurrency: int) -> list[BenchmarkResult]:
+    import httpx
+    from src.main import app, container
+
+    results = []
+    # ASGITransport does not send lifespan events, the application is started explicitly
+    async with app.router.lifespan_context(app):
+        await seed(container.database_client().get_db(), container.crypto_service())
+
+        async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app, client=("127.0.0.1", 5000)), base_url="http://bench") as client:
+            async def request(method: str, url: str, expected: int = 200, **kwargs):
+                response = await client.request(method, url, **kwargs)
+                if response.status_code != expected:
+                    raise Exception(f"{method} {url}: {response.status_code}")
+                return response
+
+            sign_in = await request("POST", "/auth/sign-in", data={ "username": BENCH_EMAIL, "password": BENCH_PASSWORD })
+            headers = { "Authorization": f"Bearer {sign_in.json()['access_token']}" }
+            await request("POST", "/user/img", headers=headers, files={ "file": ("avatar.png", create_picture(), "image/png") })
+
+            # bcrypt dominates the sign-in, it gets fewer iterations
+            results.append(await measure("POST /auth/sign-in", lambda: request("POST", "/auth/sign-in", data={ "username": BENCH_EMAIL, "password": BENCH_PASSWORD }), max(iterations // 10, 10), concurrency))
+            results.append(await measure("POST /auth/validate-token", lambda: request("POST", "/auth/validate-token", headers=headers), iterations, concurrency))
+            results.append(await measure("GET /user", lambda: request("GET", "/user", headers=headers), iterations, concurrency))
+            results.append(await measure("GET /user/img", lambda: request("GET", "/user/img", headers=headers), iterations, concurrency))
+            results.append(await measure("GET /admin/users", lambda: request("GET", "/admin/users", headers=headers), iterations, concurrency))
+            results.append(await measure("GET /products", lambda: request("GET", "/products", headers=headers), iterations, concurrency))
+    return results
+
+async def main():
+    parser = argparse.ArgumentParser(description="Benchmarks of the authentication hot paths")
+    parser.add_argument("--suite", choices=["micro", "http", "all"], default="all")
+    parser.add_argument("--iterations", type=int, default=200)
+    parser.add_argument("--concurrency", type=int, default=10)
+    parser.add_argument("--db-url", default="mongodb://localhost:27017")
+    parser.add_argument("--db-name", default="auth-service-benchmark")
+    parser.add_argument("--output", help="Write the results to a JSON file")
+    parser.add_argument("--compare", help="JSON file of a previous run to compare with")
+    args = parser.parse_args()
+
+    configure_environment(args.db_url, args.db_name)
+    results = []
+    if args.suite in ("micro", "all"):
+        results += await run_micro(args.iterations)
+    if args.suite in ("http", "all"):
+        results += await run_http(args.iterations, args.concurrency)
+
+    print_results(results)
+    if args.compare:
+        with open(args.compare, "r") as f:
+            print_comparison(results, json.load(f))
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump({
+                "commit": get_commit(),
+                "date": datetime.now(timezone.utc).isoformat(),
+                "results": [r.to_dict() for r in results],
+            }, f, indent=2)
+
+if __name__ == "__main__":
+    asyncio.run(main())
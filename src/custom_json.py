@@ -1,6 +1,8 @@
 from datetime import datetime
+from typing import AsyncIterator
 import json
 from bson import ObjectId
+from pydantic import BaseModel
 
 class MJSONEncoder(json.JSONEncoder):
     def default(self, o):
@@ -8,4 +10,17 @@ class MJSONEncoder(json.JSONEncoder):
             return str(o)
         if isinstance(o, datetime):
             return o.isoformat()
-        return json.JSONEncoder.default(self, o)
\ No newline at end of file
+        return json.JSONEncoder.default(self, o)
+
+def encode_item(item) -> str:
+    if isinstance(item, BaseModel):
+        return item.model_dump_json(by_alias=True)
+    return MJSONEncoder().encode(item)
+
+def encode_list(items: list) -> str:
+    return "[" + ",".join(encode_item(x) for x in items) + "]"
+
+# Newline delimited JSON, every item is written as soon as it is read from the cursor
+async def ndjson_stream(items: AsyncIterator) -> AsyncIterator[str]:
+    async for item in items:
+        yield encode_item(item) + "\n"
\ No newline at end of file
@@ -1,22 +1,21 @@
-from pymongo import AsyncMongoClient
-from pymongo.server_api import ServerApi
-from dotenv import load_dotenv
-import os
+from dependency_injector.wiring import Provide
 
-load_dotenv()
-client = AsyncMongoClient(os.environ["DB_URL"], server_api= ServerApi(version='1', strict=True, deprecation_errors=True))
-database = client.get_database(os.environ["DB_NAME"])
+from src.services.mongodb_service import MongoAsyncService
+from src.dependency_injection.containers import Container
+
+# Same client and connection pool used by the routers that depend on Container.database_client
+database_client: MongoAsyncService = Provide[Container.database_client]
 
 async def get_db():
     try:
-        yield database
+        yield database_client.get_db()
     except Exception as e:
         print(e)
         raise e
         
 async def close_db():
     try:
-        await client.close()
+        await database_client.close_db()
     except Exception as e:
         print(e)
-        raise e
\ No newline at end of file
+        raise e
@@ -1,10 +1,18 @@
 from dependency_injector import containers, providers
 import os
 from dotenv import load_dotenv
-from log2mongo import log2mongo
+import httpx
 
 from src.services import mongodb_service
+from src.services.cache_service import LRUCache
 from src.services.crypto_service import CryptoService
+from src.services.google_jwks_service import GoogleJWKS
+from src.services.log_service import BufferedMongoLogger
+from src.services.rate_limit_service import RateLimiter
+from src.services.revocation_service import RevocationList
+from src.services.signing_key_service import SigningKeyService
+from src.services.thumbnail_service import ThumbnailService
+from src.services.user_cache_service import UserCache
 from src.services.totp_service import TOTP
 
 load_dotenv()
@@ -23,25 +31,112 @@ class Container(containers.DeclarativeContainer):
             "src.services.jwt_service",
             "src.routers.products_router",
             "src.services.totp_service",
+            "src.services.index_service",
+            "src.dependencies",
+            "src.services.oauth_google_service",
+            "src.services.twofactor_service",
+            "src.services.refresh_token_service",
             ])
 
     #config = providers.Configuration(ini_files=["config.ini"])
 
     logging = providers.Singleton(
-        log2mongo,
+        BufferedMongoLogger,
         os.environ["LOG_DB_URL"], #config.log.db_url,
         os.environ["LOG_DATABASE_NAME"], #config.log.db_database,
         level = os.environ["LOG_LEVEL"], #config.log.level
+        max_queue = int(os.environ["LOG_QUEUE_MAX_SIZE"]),
+        batch_size = int(os.environ["LOG_BATCH_SIZE"]),
+        flush_interval = float(os.environ["LOG_FLUSH_INTERVAL_SECONDS"]),
     )
 
     database_client = providers.Singleton(
         mongodb_service.MongoAsyncService,
         os.environ["DB_URL"], #config.database.url,
         os.environ["DB_NAME"], #config.database.name
+        int(os.environ["DB_MAX_POOL_SIZE"]),
+        int(os.environ["DB_MIN_POOL_SIZE"]),
+        int(os.environ["DB_WAIT_QUEUE_TIMEOUT_MS"]) if os.environ["DB_WAIT_QUEUE_TIMEOUT_MS"] else None,
+        os.environ["DB_COMPRESSORS"].split(',') if os.environ["DB_COMPRESSORS"] else None,
+    )
+
+    # Shared by the calls to external services, so their connections are reused
+    http_client = providers.Singleton(
+        httpx.AsyncClient,
+        timeout = httpx.Timeout(float(os.environ["HTTP_CLIENT_TIMEOUT_SECONDS"])),
+        limits = httpx.Limits(max_connections = 20, max_keepalive_connections = 10)
+    )
+
+    google_jwks = providers.Singleton(
+        GoogleJWKS,
+        os.environ["GOOGLE_OAUTH_JWKS_URI"],
+        os.environ["GOOGLE_OAUTH_JWKS_FILE"],
+        int(os.environ["GOOGLE_OAUTH_JWKS_REFRESH_SECONDS"]),
+        http_client,
+        logging
     )
 
     crypto_service = providers.Singleton(
         CryptoService,
+        logging,
+        os.environ["CRYPTO_PASSWORD_EXECUTOR"],
+        int(os.environ["CRYPTO_PASSWORD_WORKERS"]),
+        int(os.environ["CRYPTO_PASSWORD_MAX_QUEUE"])
+    )
+
+    signing_keys = providers.Singleton(
+        SigningKeyService,
+        os.environ["JWT_ALGORITHM"],
+        os.environ["JWT_SIGNING_KEY_FILE"],
+        os.environ["JWT_VERIFICATION_KEY_FILES"].split(',') if os.environ["JWT_VERIFICATION_KEY_FILES"] else [],
+        logging
+    )
+
+    token_cache = providers.Singleton(
+        LRUCache,
+        int(os.environ["TOKEN_CACHE_MAX_SIZE"])
+    )
+
+    revocations = providers.Singleton(
+        RevocationList,
+        database_client,
+        os.environ["DB_REVOKED_TOKENS_COLLECTION"],
+        int(os.environ["REVOCATION_POLL_SECONDS"]),
+        int(os.environ["JWT_EXPIRE_MINUTES"]),
+        logging
+    )
+
+    twofactor_secrets = providers.Singleton(
+        LRUCache,
+        int(os.environ["TOTP_SECRET_CACHE_MAX_SIZE"]),
+        int(os.environ["TOTP_SECRET_CACHE_TTL_SECONDS"])
+    )
+
+    user_cache = providers.Singleton(
+        UserCache,
+        os.environ["USER_CACHE_BACKEND"],
+        int(os.environ["USER_CACHE_MAX_SIZE"]),
+        int(os.environ["USER_CACHE_TTL_SECONDS"]),
+        os.environ["USER_CACHE_REDIS_URL"],
+        logging
+    )
+
+    sign_in_limiter = providers.Singleton(
+        RateLimiter,
+        os.environ["SIGN_IN_RATE_LIMIT_BACKEND"],
+        int(os.environ["SIGN_IN_IP_LIMIT"]),
+        int(os.environ["SIGN_IN_IP_WINDOW_SECONDS"]),
+        int(os.environ["SIGN_IN_USERNAME_LIMIT"]),
+        int(os.environ["SIGN_IN_USERNAME_WINDOW_SECONDS"]),
+        int(os.environ["SIGN_IN_RATE_LIMIT_MAX_KEYS"]),
+        os.environ["SIGN_IN_RATE_LIMIT_REDIS_URL"],
+        logging
+    )
+
+    thumbnails = providers.Singleton(
+        ThumbnailService,
+        [int(x) for x in os.environ["USER_PICTURE_VARIANT_SIZES"].split(',')] if os.environ["USER_PICTURE_VARIANT_SIZES"] else [],
+        int(os.environ["USER_PICTURE_VARIANT_WORKERS"]),
         logging
     )
 
@@ -51,5 +146,9 @@ class Container(containers.DeclarativeContainer):
         os.environ["TOTP_DIGEST"],
         int(os.environ["TOTP_TIME_STEP"]),
         int(os.environ["TOTP_RETURN_DIGITS"]),
-        logging
+        logging,
+        int(os.environ["TOTP_TIME_WINDOW"]),
+        int(os.environ["TOTP_KEY_CACHE_MAX_SIZE"]),
+        os.environ["TOTP_REPLAY_BACKEND"],
+        os.environ["TOTP_REPLAY_REDIS_URL"]
     )
\ No newline at end of file
@@ -1,19 +1,23 @@
 from datetime import datetime
-from fastapi import FastAPI
+from fastapi import FastAPI, Response
 from contextlib import asynccontextmanager
 from fastapi.middleware.cors import CORSMiddleware
 from dotenv import load_dotenv
-import os
+import asyncio, os
 
-from src.routers import auth_router, products_router, users_router, oauth2_router
+from src.routers import auth_router, products_router, users_router, oauth2_router, well_known_router
 from src.routers.admin import users_router as admin_user_router, security_router
 from src.middlewares.jwt_middleware import JWTMiddleware
 from src.middlewares.http_middleware import HttpMiddleware
 from src.dependency_injection.containers import Container
 from src.dependencies import close_db
+from src.services.index_service import ensure_indexes
+from src.services import metrics_service
 
 load_dotenv()
 origins = os.environ["CORS_ALLOWED_HOSTS"].split(',') if os.environ["CORS_ALLOWED_HOSTS"] else []
+public_paths = os.environ["JWT_PUBLIC_PATHS"].split(',') if os.environ["JWT_PUBLIC_PATHS"] else []
+background_tasks = set()
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
@@ -23,20 +27,45 @@ async def lifespan(app: FastAPI):
 
 async def start():
     print("Website is starting!")
+    container.logging().start()
+    # Loaded before serving, a revoked token must not be accepted while the list is empty
+    await container.revocations().load_at_startup()
+    container.revocations().start()
+    if os.environ["GOOGLE_OAUTH_CLIENT"]:
+        container.google_jwks().start()
+    if os.environ["DB_ENSURE_INDEXES"] == "true":
+        db = container.database_client().get_db()
+        if os.environ["DB_INDEXES_BACKGROUND"] == "true":
+            # Building indexes on a large collection can take a while, do not hold the startup
+            task = asyncio.create_task(ensure_indexes(db))
+            background_tasks.add(task)
+            task.add_done_callback(background_tasks.discard)
+        else:
+            await ensure_indexes(db)
 
 async def shutdown():
+    await container.revocations().stop()
     await close_db()
+    container.crypto_service().shutdown()
+    await container.user_cache().close()
+    await container.totp().close()
+    await container.sign_in_limiter().close()
+    container.thumbnails().shutdown()
+    await container.google_jwks().stop()
+    await container.http_client().aclose()
+    await container.logging().stop()
     print("Website is shutting down!")
 
 app = FastAPI(lifespan=lifespan)
 container = Container()
+# Added first so it runs inside CORSMiddleware, rejected requests still get the CORS headers
+app.add_middleware(JWTMiddleware, public_paths = public_paths)
 app.add_middleware(
     CORSMiddleware,
     allow_origins = origins,
     allow_methods = ["*"],
     allow_headers = ["*"])
-#app.add_middleware(HttpMiddleware)
-#app.add_middleware(JWTMiddleware, secret_key= SECRET_KEY, algorithm= ALGORITHM)
+app.add_middleware(HttpMiddleware)
 
 app.include_router(auth_router.router)
 app.include_router(users_router.router)
@@ -44,6 +73,7 @@ app.include_router(products_router.router)
 app.include_router(admin_user_router.router)
 app.include_router(security_router.router)
 app.include_router(oauth2_router.router)
+app.include_router(well_known_router.router)
 
 #Root route
 @app.get("/")
@@ -54,3 +84,8 @@ async def main():
 @app.get("/auth/health")
 async def health():
     return datetime.now()
+
+#Prometheus metrics
+@app.get("/metrics")
+async def metrics():
+    return Response(metrics_service.render(), media_type = "text/plain; version=0.0.4")
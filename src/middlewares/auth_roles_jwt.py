@@ -1,8 +1,8 @@
 from typing import Dict
-from fastapi import HTTPException, Request
+from fastapi import Request
 from fastapi.security import OAuth2PasswordBearer
 
-from src.services.jwt_service import verify_token_and_roles
+from src.services.jwt_service import check_roles, get_request_principal
 
 class JWTCustom(OAuth2PasswordBearer):
 
@@ -10,11 +10,9 @@ class JWTCustom(OAuth2PasswordBearer):
         super().__init__(tokenUrl, scheme_name, scopes, description, auto_error)
     
     async def __call__(self, request: Request):
-        try:
-            token = await super().__call__(request)
-            if token is not None:
-                email = await verify_token_and_roles(token, ['admin'])
-                return email
-        except Exception as e:
-            raise e
-        
\ No newline at end of file
+        # Only checks the header, the token is verified once per request by get_request_principal
+        if await super().__call__(request) is None:
+            return None
+        principal = await get_request_principal(request)
+        check_roles(principal, ['admin'])
+        return principal.email
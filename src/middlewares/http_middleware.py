@@ -1,23 +1,47 @@
 from __future__ import annotations
 
-from starlette.datastructures import Headers, MutableHeaders
-from starlette.responses import PlainTextResponse, Response
+from starlette.routing import Match
 from starlette.types import ASGIApp, Message, Receive, Scope, Send
-from fastapi.middleware.httpsredirect import HTTPSRedirectMiddleware
+import time
+
+from src.services import metrics_service as metrics
+from src.services import tracing_service as tracing
+
+def get_route(scope: Scope) -> str:
+    # The route template is set by the router. Requests rejected before the routing (JWTMiddleware) are
+    # matched against the routes here, unknown paths share one label to keep the series bounded
+    if (route := scope.get("route")) is not None:
+        return route.path
+    if (app := scope.get("app")) is not None:
+        for route in app.router.routes:
+            if route.matches(scope)[0] == Match.FULL:
+                return getattr(route, "path", "unmatched")
+    return "unmatched"
 
 class HttpMiddleware:
     def __init__(self, app: ASGIApp) -> None:
         self.app = app
 
     async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
-        try:
-            if scope["type"] != "http":
-                await self.app(scope, receive, send)
-                return
-            
-            headers = Headers(scope=scope)
-            
+        if scope["type"] != "http":
             await self.app(scope, receive, send)
-            
-        except Exception as e:
-            print(e)
+            return
+
+        status_code = 500
+        async def send_wrapper(message: Message) -> None:
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+            await send(message)
+
+        metrics.http_in_flight.inc()
+        start = time.perf_counter()
+        with tracing.server_span(scope) as span:
+            try:
+                await self.app(scope, receive, send_wrapper)
+            finally:
+                metrics.http_in_flight.dec()
+                route = get_route(scope)
+                metrics.http_duration.observe((scope["method"], route), time.perf_counter() - start)
+                metrics.http_requests.inc((scope["method"], route, status_code))
+                tracing.end_server_span(span, scope["method"], route, status_code)
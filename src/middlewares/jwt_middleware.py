@@ -1,26 +1,45 @@
 from __future__ import annotations
 
-from starlette.datastructures import Headers, MutableHeaders
-from starlette.responses import PlainTextResponse, Response
-from starlette.types import ASGIApp, Message, Receive, Scope, Send
-from fastapi.middleware.httpsredirect import HTTPSRedirectMiddleware
+from fastapi import HTTPException
+from starlette.datastructures import Headers
+from starlette.responses import JSONResponse
+from starlette.types import ASGIApp, Receive, Scope, Send
 
-from src.services.jwt_service import verify_token
+from src.services.jwt_service import get_principal
 
 class JWTMiddleware:
-    def __init__(self, app: ASGIApp, secret_key: str, algorithm: str) -> None:
+    def __init__(self, app: ASGIApp, public_paths: list[str]) -> None:
         self.app = app
-        self.secret_key = secret_key
-        self.algorithm = algorithm
+        # Entries ending with * are prefixes, the others must match the whole path
+        self.public_paths = {x for x in public_paths if not x.endswith("*")}
+        self.public_prefixes = tuple(x.removesuffix("*") for x in public_paths if x.endswith("*"))
+
+    def is_public(self, path: str) -> bool:
+        return path in self.public_paths or path.startswith(self.public_prefixes)
 
     async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
-        if scope["type"] != "http":
+        if scope["type"] != "http" or scope["method"] == "OPTIONS" or self.is_public(scope["path"]):
             await self.app(scope, receive, send)
             return
 
-        headers = Headers(scope=scope)
-        request_token = headers.get("Authorization")
-        email, is_token_valid = await verify_token(request_token.__str__())
+        # Rejected before the routing and the body parsing, the request body is never read
+        scheme, _, token = Headers(scope=scope).get("Authorization", "").partition(" ")
+        if scheme.lower() != "bearer" or not token:
+            response = JSONResponse({ "detail": "Not authenticated" }, 401, { "WWW-Authenticate": "Bearer" })
+            await response(scope, receive, send)
+            return
+
+        try:
+            principal = await get_principal(token)
+        except HTTPException as e:
+            response = JSONResponse({ "detail": e.detail }, e.status_code, e.headers)
+            await response(scope, receive, send)
+            return
+        except Exception:
+            response = JSONResponse({ "detail": "Invalid credentials" }, 401, { "WWW-Authenticate": "Bearer" })
+            await response(scope, receive, send)
+            return
 
+        # request.state reads scope["state"], the route dependencies use the principal instead of decoding the token again
+        scope.setdefault("state", {})["principal"] = principal
         await self.app(scope, receive, send)
-        
\ No newline at end of file
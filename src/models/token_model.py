@@ -1,8 +1,38 @@
-from pydantic import BaseModel
+from datetime import datetime
+from typing import List, Optional
+from pydantic import BaseModel, Field
 
 class Token(BaseModel):
     access_token: str
     token_type: str
+    refresh_token: Optional[str] = None
+
+class RefreshTokenRequest(BaseModel):
+    refresh_token: str
+
+class TwoFactorChallenge(BaseModel):
+    challenge_token: str
+    token_type: str = "twofactor"
+    twofactor_required: bool = True
+
+class TwoFactorSignIn(BaseModel):
+    challenge_token: str
+    code: str
 
 class TokenData(BaseModel):
-    username: str | None = None
\ No newline at end of file
+    username: str | None = None
+
+class TokensValidation(BaseModel):
+    tokens: List[str] = Field(max_length=100)
+
+class TokenValidationResult(BaseModel):
+    valid: bool = False
+    email: Optional[str] = None
+    roles: List[str] = list()
+    expires_at: Optional[datetime] = None
+    error: Optional[str] = None
+class Principal(BaseModel):
+    email: str
+    roles: List[str] = list()
+    exp: Optional[int] = None
+    jti: Optional[str] = None
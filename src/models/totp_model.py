@@ -1,5 +1,10 @@
 from enum import Enum
+from pydantic import BaseModel
 
 class TOTPOptions(str, Enum):
     ascii = "ascii"
-    hex = "hex"
\ No newline at end of file
+    hex = "hex"
+
+class TwoFactorEnrollment(BaseModel):
+    secret: str
+    otpauth_uri: str
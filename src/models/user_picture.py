@@ -1,15 +1,26 @@
 from datetime import datetime
-from typing import Optional
+from typing import Dict, Optional
 from pydantic import BaseModel, Field
 import base64
 
 from src.models.pydantic_objects import PyObjectId
 
+class PictureVariant(BaseModel):
+    content_type: str
+    etag: str
+    length: int
+    picture: bytes
+
 class UserPicture(BaseModel):
     id: Optional[PyObjectId] = Field(default= None, serialization_alias="_id")
     content_type: str | None = None
     picture: Optional[bytes] = None
     picture_url: Optional[str] = None
+    file_id: Optional[PyObjectId] = None
+    etag: Optional[str] = None
+    length: Optional[int] = None
+    chunk_size: Optional[int] = None
+    variants: Optional[Dict[str, PictureVariant]] = None
     created_at: datetime = datetime.now()
     updated_at: Optional[datetime] = None
 
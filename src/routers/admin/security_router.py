@@ -5,6 +5,14 @@ from dependency_injector.wiring import Provide, inject
 from src.dependency_injection.containers import Container
 from src.middlewares.auth_roles_jwt import JWTCustom
 from src.models.totp_model import TOTPOptions
+from src.services.jwt_service import get_token_cache_stats
+from src.services.user_cache_service import UserCache
+from src.services.log_service import BufferedMongoLogger
+from src.services.rate_limit_service import RateLimiter
+from src.services.revocation_service import RevocationList
+from src.services.mongodb_service import MongoAsyncService
+from src.services.index_service import get_indexes_report
+from src.services.twofactor_service import get_secret_cache_stats
 import src.services.totp_service as securitySvc
 
 oauth2_scheme = JWTCustom(tokenUrl="/auth/sign-in")
@@ -13,6 +21,11 @@ router = APIRouter(
     dependencies=[Depends(oauth2_scheme)],
     prefix="/security")
 totp_dependency = Annotated[securitySvc.TOTP, Depends(Provide[Container.totp])]
+user_cache_dependency = Annotated[UserCache, Depends(Provide[Container.user_cache])]
+db_dependency = Annotated[MongoAsyncService, Depends(Provide[Container.database_client])]
+log_dependency = Annotated[BufferedMongoLogger, Depends(Provide[Container.logging])]
+limiter_dependency = Annotated[RateLimiter, Depends(Provide[Container.sign_in_limiter])]
+revocations_dependency = Annotated[RevocationList, Depends(Provide[Container.revocations])]
 
 @router.get("/2fa-now/{options}")
 @inject
@@ -40,4 +53,43 @@ async def get_2f_code_verify(code: str, totp: totp_dependency, secret: Optional[
     if result:
         return Response(status_code=200)
     else:
-        return Response(status_code=401)
\ No newline at end of file
+        return Response(status_code=401)
+
+@router.get("/totp")
+@inject
+async def get_totp_stats(totp: totp_dependency):
+    return { **totp.get_stats(), "secrets": await get_secret_cache_stats() }
+
+@router.get("/token-cache")
+async def get_token_cache():
+    return await get_token_cache_stats()
+
+@router.get("/user-cache")
+@inject
+async def get_user_cache(user_cache: user_cache_dependency):
+    return user_cache.get_stats()
+
+@router.get("/indexes")
+@inject
+async def get_indexes(db: db_dependency):
+    return await get_indexes_report(db.get_db())
+
+@router.get("/db-pool")
+@inject
+async def get_db_pool(db: db_dependency):
+    return db.get_pool_stats()
+
+@router.get("/logging")
+@inject
+async def get_logging(log: log_dependency):
+    return log.get_stats()
+
+@router.get("/rate-limit")
+@inject
+async def get_rate_limit(limiter: limiter_dependency):
+    return limiter.get_stats()
+
+@router.get("/revocations")
+@inject
+async def get_revocations(revocations: revocations_dependency):
+    return revocations.get_stats()
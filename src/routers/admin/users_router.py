@@ -1,9 +1,12 @@
-from typing import Annotated
-from fastapi import APIRouter, Depends, Response
+from typing import Annotated, Optional
+from bson import ObjectId
+from fastapi import APIRouter, Depends, HTTPException, Query, Response
+from fastapi.responses import StreamingResponse
 from pymongo.asynchronous.database import AsyncDatabase
 from log2mongo import log2mongo
 from dependency_injector.wiring import Provide, inject
 
+from src.custom_json import encode_list, ndjson_stream
 from src.models.user_model import User
 from src.models.address_model import Address
 from src.services.user_service import change_password, get_address, insert_address
@@ -33,11 +36,21 @@ async def get_user(email: str, db: db_dependency, log: log_dependency, response:
 
 @router.get("/users")
 @inject
-async def get_users(db: db_dependency, log: log_dependency, response: Response) -> list[User] | None:
+async def get_users(db: db_dependency, log: log_dependency, response: Response, after: Optional[str] = None, limit: Annotated[int, Query(ge=1, le=1000)] = 100, fields: Optional[str] = None, stream: bool = False):
     try:
-        users = await uSvc.get_users(db)
+        if after and not ObjectId.is_valid(after):
+            return Response(status_code=400)
+        fields_list = fields.split(',') if fields else None
+
+        if stream:
+            return StreamingResponse(ndjson_stream(uSvc.iterate_users(db, after, limit, fields_list)), media_type="application/x-ndjson")
+
+        users = await uSvc.get_users(db, after, limit, fields_list)
         if users:
-            return users
+            # The id of the last user is the cursor of the next page
+            last = users[-1]
+            headers = {"X-Next-Cursor": str(last.id if isinstance(last, User) else last["id"])} if len(users) == limit else None
+            return Response(encode_list(users), media_type="application/json", headers=headers)
         response.status_code = 404
     except Exception as e:
         log.logger.error(e)
@@ -50,6 +63,8 @@ async def create_user(model: User, db: db_dependency, log: log_dependency, respo
         if user:
             return user
         response.status_code = 400
+    except HTTPException as e:
+        raise e
     except Exception as e:
         log.logger.error(e)
 
@@ -84,6 +99,8 @@ async def update_password(email: str, password: str, db: db_dependency, log: log
             response.status_code = 200
             return
         response.status_code = 400
+    except HTTPException as e:
+        raise e
     except Exception as e:
         log.logger.error(e)
 
@@ -1,4 +1,4 @@
-from typing import Annotated
+from typing import Annotated, Optional
 from fastapi import APIRouter, Depends, HTTPException, Request, Response, status
 from fastapi.security import OAuth2PasswordRequestForm
 from fastapi.responses import JSONResponse
@@ -7,11 +7,16 @@ from log2mongo import log2mongo
 
 from src.middlewares.auth_jwt import JWTCustom
 from src.models.sign_up_model import SignUp
+from src.models.token_model import RefreshTokenRequest, Token, TokensValidation, TokenValidationResult, TwoFactorSignIn
 from src.models.user_model import User
 from src.services.mongodb_service import MongoAsyncService
+from src.services.rate_limit_service import RateLimiter
 from src.dependency_injection.containers import Container
-from src.services.login_service import login
+from src.services.login_service import login, login_second_factor, refresh
 from src.services.user_service import create_user
+from src.services.jwt_service import get_request_principal, verify_challenge_token, verify_tokens
+from src.services.refresh_token_service import revoke_refresh_token
+from src.services.revocation_service import RevocationList
 
 router = APIRouter(
     tags=["auth"],
@@ -20,6 +25,13 @@ router = APIRouter(
 oauth2_scheme = JWTCustom(tokenUrl="/auth/sign-in")
 db_dependency = Annotated[MongoAsyncService, Depends(Provide[Container.database_client])]
 log_dependency = Annotated[log2mongo, Depends(Provide[Container.logging])]
+limiter_dependency = Annotated[RateLimiter, Depends(Provide[Container.sign_in_limiter])]
+revocations_dependency = Annotated[RevocationList, Depends(Provide[Container.revocations])]
+
+async def check_rate_limit(limiter: RateLimiter, ip: str, username: str):
+    # Checked before the password is verified, rejected attempts never reach bcrypt
+    if (retry_after := await limiter.acquire(ip, username)) > 0:
+        raise HTTPException(status_code=status.HTTP_429_TOO_MANY_REQUESTS, detail="Too many sign-in attempts", headers={"Retry-After": str(retry_after)})
 
 @router.post("/sign-up")
 @inject
@@ -29,6 +41,7 @@ async def sign_up(model: SignUp, db: db_dependency, log: log_dependency, request
         log.logger.info(f"{ model.email } sign-up from ip: { client_host }")
         content = ""
         status_code = 0
+        headers = None
         user = await create_user(db.database, User(
             name = model.name,
             email = model.email,
@@ -43,31 +56,95 @@ async def sign_up(model: SignUp, db: db_dependency, log: log_dependency, request
             content = "Unable to create user"
             status_code = status.HTTP_400_BAD_REQUEST
 
+    except HTTPException as e:
+        content = e.detail
+        status_code = e.status_code
+        headers = e.headers
     except Exception as e:
         log.logger.error(e)
     finally:
-        return Response(content, status_code, media_type="application/json")
+        return Response(content, status_code, headers, media_type="application/json")
 
 @router.post("/sign-in")
 @inject
-async def sign_in(form_data: Annotated[OAuth2PasswordRequestForm, Depends()], db: db_dependency, log: log_dependency, request: Request):
+async def sign_in(form_data: Annotated[OAuth2PasswordRequestForm, Depends()], db: db_dependency, log: log_dependency, limiter: limiter_dependency, request: Request):
     try:
         client_host = request.client.host # type: ignore
         log.logger.info(f"{ form_data.username } login from ip: { client_host }")
         content = None
         status_code = status.HTTP_401_UNAUTHORIZED
+        headers = None
+        username = form_data.username.strip().lower()
+        await check_rate_limit(limiter, client_host, username)
         result, token = await login(form_data.username, form_data.password, db.database)
         if token:
+            # A challenge only proves the password, the attempts are reset once the access token is issued
+            if isinstance(token, Token):
+                await limiter.reset(username)
             content = token.model_dump()
             status_code = status.HTTP_200_OK
         elif result and token is None:
             status_code = status.HTTP_412_PRECONDITION_FAILED
 
+    except HTTPException as e:
+        content = e.detail
+        status_code = e.status_code
+        headers = e.headers
     except Exception as e:
         log.logger.error(e)
     finally:
-        return JSONResponse(content, status_code)
+        return JSONResponse(content, status_code, headers)
     
+@router.post("/sign-in/2fa")
+@inject
+async def sign_in_second_factor(model: TwoFactorSignIn, db: db_dependency, log: log_dependency, limiter: limiter_dependency, request: Request) -> Token:
+    try:
+        # The codes are limited per user, a new challenge does not give new attempts
+        email = await verify_challenge_token(model.challenge_token)
+        await check_rate_limit(limiter, request.client.host, f"2fa:{email}") # type: ignore
+        token = await login_second_factor(email, model.code, db.database)
+        if token is not None:
+            await limiter.reset(f"2fa:{email}")
+    except HTTPException as e:
+        raise e
+    except Exception as e:
+        log.logger.error(e)
+        raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR)
+    if token is None:
+        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Invalid credentials")
+    return token
+
+@router.post("/refresh")
+@inject
+async def refresh_token(model: RefreshTokenRequest, db: db_dependency, log: log_dependency) -> Token:
+    try:
+        token = await refresh(model.refresh_token, db.database)
+    except HTTPException as e:
+        raise e
+    except Exception as e:
+        log.logger.error(e)
+        raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR)
+    if token is None:
+        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Invalid refresh token")
+    return token
+
+@router.post("/sign-out")
+@inject
+async def sign_out(db: db_dependency, revocations: revocations_dependency, log: log_dependency, request: Request, model: Optional[RefreshTokenRequest] = None):
+    principal = await get_request_principal(request)
+    try:
+        if principal.jti is not None and principal.exp is not None:
+            await revocations.revoke_token(principal.jti, principal.exp)
+        else:
+            # Tokens issued before the jti claim can only be revoked with every other token of the user
+            await revocations.revoke_user(principal.email)
+        if model is not None:
+            await revoke_refresh_token(db.database, model.refresh_token, principal.email)
+    except Exception as e:
+        log.logger.error(e)
+        raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR)
+    return Response(status_code=status.HTTP_204_NO_CONTENT)
+
 @router.post("/validate-token")
 @inject
 async def validate_token(log: log_dependency, email: Annotated[str, Depends(oauth2_scheme)]):
@@ -79,3 +156,12 @@ async def validate_token(log: log_dependency, email: Annotated[str, Depends(oaut
         log.logger.error(e)
     finally:
         return Response(email, status_code, media_type = "text/plain")
+
+@router.post("/validate-tokens")
+@inject
+async def validate_tokens(model: TokensValidation, log: log_dependency) -> list[TokenValidationResult]:
+    try:
+        return await verify_tokens(model.tokens)
+    except Exception as e:
+        log.logger.error(e)
+        raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR)
@@ -3,15 +3,15 @@ from fastapi import APIRouter, Depends, HTTPException, Request, Response, status
 from fastapi.responses import JSONResponse, RedirectResponse
 from dependency_injector.wiring import Provide, inject
 from log2mongo import log2mongo
+import asyncio
 
 from src.middlewares.auth_jwt import JWTCustom
 from src.models.user_model import User
-from src.services.jwt_service import get_token_claims_unverify_signature
 from src.services.mongodb_service import MongoAsyncService
 from src.dependency_injection.containers import Container
 from src.services.login_service import external_login
-from src.services.oauth_google_service import get_auth_url, get_auth_response
-from src.services.user_service import add_user_picture, create_user, get_user
+from src.services.oauth_google_service import get_auth_url, get_auth_response, verify_id_token
+from src.services.user_service import add_user_picture, get_user, upsert_user
 
 router = APIRouter(
     tags=["OAuth2"],
@@ -54,11 +54,12 @@ async def get_google_response(db: db_dependency, log: log_dependency, request: R
         google_token = await get_auth_response(request.url.__str__())
         
         if google_token:
-            token_data = await get_token_claims_unverify_signature(google_token.id_token.__str__()) # type: ignore
-            user = await get_user(token_data['email'], db.get_db())
+            token_data = await verify_id_token(google_token.id_token.__str__()) # type: ignore
+            user = await get_user(token_data['email'], db.get_db(), fresh = True)
+            created = False
 
             if user is None:
-                user = await create_user(db.database, User(
+                user, created = await upsert_user(db.database, User(
                     name = token_data['given_name'],
                     last_name = token_data['family_name'],
                     email= token_data['email'],
@@ -66,12 +67,15 @@ async def get_google_response(db: db_dependency, log: log_dependency, request: R
                     password= token_data['at_hash'],
                     issuer = token_data['iss'],
                     disabled=False))
-                
-                if user:
-                    result = await add_user_picture(token_data['email'], db.get_db(), pic_url = token_data["picture"])
 
             if user:
-                result, token = await external_login(user.email, token_data['iss'], db.database)
+                # The picture of a new user is saved while the token is created
+                if created:
+                    _, (result, token) = await asyncio.gather(
+                        add_user_picture(token_data['email'], db.get_db(), pic_url = token_data["picture"]),
+                        external_login(user.email, token_data['iss'], db.database, user))
+                else:
+                    result, token = await external_login(user.email, token_data['iss'], db.database, user)
 
                 if token:
                     content = token.model_dump()
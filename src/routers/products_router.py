@@ -1,11 +1,13 @@
-from typing import Annotated
+from typing import Annotated, Optional
 from bson import ObjectId
-from fastapi import APIRouter, Depends, HTTPException
+from fastapi import APIRouter, Depends, HTTPException, Query, Response
+from fastapi.responses import StreamingResponse
+from pymongo import ASCENDING
 from pymongo.asynchronous.database import AsyncDatabase
 
 from src.services.jwt_service import verify_token
 from src.services.mongodb_service import MongoService
-from src.custom_json import MJSONEncoder
+from src.custom_json import MJSONEncoder, encode_list, ndjson_stream
 from src.models.product_model import Product
 from src.middlewares.auth_jwt import JWTCustom
 from src.dependencies import get_db
@@ -39,12 +41,32 @@ async def list_item(item_id: str, db: db_dependency):
     return MJSONEncoder().encode(product)
 
 
-# Route to list all items
+async def iterate_items(db: AsyncDatabase, after: str | None, limit: int, fields: list[str] | None):
+    query = {"_id": {"$gt": ObjectId(after)}} if after else {}
+    projection = { field: 1 for field in fields } if fields else None
+    async for product in db["Products"].find(query, projection).sort("_id", ASCENDING).limit(limit):
+        if fields:
+            product["id"] = product.pop("_id")
+            yield product
+        else:
+            yield Product(**product)
+
+# Route to list all items, paginated by _id
 @router.get("/products")
-async def list_items(token: Annotated[str, Depends(oauth2_scheme)], db: db_dependency):
-    products = await db["Products"].find({}).to_list()
-    p = [(Product(**x)).dict() for x in products]
-    return p
+async def list_items(token: Annotated[str, Depends(oauth2_scheme)], db: db_dependency, after: Optional[str] = None, limit: Annotated[int, Query(ge=1, le=1000)] = 100, fields: Optional[str] = None, stream: bool = False):
+    if after and not ObjectId.is_valid(after):
+        raise HTTPException(status_code=400, detail="Invalid cursor.")
+    fields_list = fields.split(',') if fields else None
+
+    if stream:
+        return StreamingResponse(ndjson_stream(iterate_items(db, after, limit, fields_list)), media_type="application/x-ndjson")
+
+    products = [x async for x in iterate_items(db, after, limit, fields_list)]
+    headers = None
+    if products and len(products) == limit:
+        last = products[-1]
+        headers = {"X-Next-Cursor": str(last.id if isinstance(last, Product) else last["id"])}
+    return Response(encode_list(products), media_type="application/json", headers=headers)
 
 # Route to add an item
 @router.put("/products")
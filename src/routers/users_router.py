@@ -1,18 +1,19 @@
-from typing import Annotated
-from fastapi import APIRouter, Depends, Response, UploadFile, status
+from typing import Annotated, Optional
+from fastapi import APIRouter, BackgroundTasks, Depends, HTTPException, Request, Response, UploadFile, status
 from fastapi.responses import JSONResponse, StreamingResponse
 from dependency_injector.wiring import Provide, inject
-import io
+import hashlib
 
 from src.middlewares.auth_jwt import JWTCustom
 from src.models.user_model import User
 from src.models.address_model import Address
+from src.models.totp_model import TwoFactorEnrollment
 from src.dependency_injection.containers import Container
 from src.services.mongodb_service import MongoAsyncService
 from src.services.user_service import change_password, insert_address, get_address
-from src.services.jwt_service import verify_token_from_requests
-from src.services.totp_service import TOTP
+from src.services.thumbnail_service import ThumbnailService
 import src.services.user_service as uSvc
+import src.services.twofactor_service as twofactor
 from src.dependencies import get_db
 
 oauth2_scheme = JWTCustom(tokenUrl="/auth/sign-in")
@@ -21,12 +22,33 @@ router = APIRouter(
     dependencies=[Depends(oauth2_scheme)])
 #db_dependency = Annotated[AsyncDatabase, Depends(get_db)]
 db_dependency = Annotated[MongoAsyncService, Depends(Provide[Container.database_client])]
-totp_dependency = Annotated[TOTP, Depends(Provide[Container.totp])]
+thumbnails_dependency = Annotated[ThumbnailService, Depends(Provide[Container.thumbnails])]
+
+def etag_matches(if_none_match: str, etag: str) -> bool:
+    if if_none_match.strip() == "*":
+        return True
+    return etag in [x.strip().removeprefix("W/") for x in if_none_match.split(",")]
+
+def parse_range(range_header: str, length: int) -> tuple[int, int] | None:
+    # Only a single byte range is supported, any other value is ignored and the whole picture is sent
+    unit, _, value = range_header.partition("=")
+    if unit.strip() != "bytes" or "," in value:
+        return None
+    first, _, last = value.strip().partition("-")
+    try:
+        if first:
+            # A last position before the first one makes the range invalid, it is ignored as RFC 9110 says
+            if last and int(last) < int(first):
+                return None
+            return int(first), min(int(last), length - 1) if last else length - 1
+        return max(length - int(last), 0), length - 1
+    except ValueError:
+        return None
 
 # Route to add an users
 @router.get("/user")
 @inject
-async def get_user(db: db_dependency, email: Annotated[str, Depends(verify_token_from_requests)]):
+async def get_user(db: db_dependency, email: Annotated[str, Depends(oauth2_scheme)]):
     user = await uSvc.get_user(email, db.get_db())
     if user:
         return user
@@ -35,21 +57,59 @@ async def get_user(db: db_dependency, email: Annotated[str, Depends(verify_token
 
 @router.post("/user/img", response_model_by_alias = False)
 @inject
-async def add_user_image(file: UploadFile, db: db_dependency, email: Annotated[str, Depends(verify_token_from_requests)]):
+async def add_user_image(file: UploadFile, db: db_dependency, background_tasks: BackgroundTasks, email: Annotated[str, Depends(oauth2_scheme)]):
+    if file.size is not None and file.size > uSvc.picture_max_size:
+        return Response(status_code= status.HTTP_413_REQUEST_ENTITY_TOO_LARGE)
     result = await uSvc.add_user_picture(email, db.get_db(), file = file, content_type = file.content_type)
     if result:
+        # The smaller sizes are generated after the response is sent
+        background_tasks.add_task(uSvc.add_picture_variants, email, db.get_db())
         return Response(status_code= status.HTTP_200_OK)
     else:
         return Response(status_code= status.HTTP_400_BAD_REQUEST)
     
 @router.get("/user/img", response_model_by_alias = False)
 @inject
-async def get_user_image(db: db_dependency, email: Annotated[str, Depends(verify_token_from_requests)]):
-    result = await uSvc.get_user_picture(email, db.get_db())
-    if result and result.picture:
-        return StreamingResponse(io.BytesIO(result.picture), media_type= result.content_type)
-    else:
+async def get_user_image(db: db_dependency, thumbnails: thumbnails_dependency, request: Request, email: Annotated[str, Depends(oauth2_scheme)], size: Optional[int] = None):
+    if size is not None and size not in thumbnails.sizes:
         return Response(status_code= status.HTTP_400_BAD_REQUEST)
+    result = await uSvc.get_user_picture(email, db.get_db(), size)
+    if result is None or not (result.file_id or result.picture):
+        return Response(status_code= status.HTTP_400_BAD_REQUEST)
+
+    content_type, data = result.content_type, result.picture
+    # The original is sent while the requested size has not been generated yet, it is revalidated
+    # on every request so the client does not keep it for the thumbnail URL
+    cache_control = "no-cache" if size is not None else "private, max-age=86400"
+    if size is not None and result.variants and (variant := result.variants.get(str(size))):
+        etag, length, content_type, data = variant.etag, variant.length, variant.content_type, variant.picture
+        cache_control = "private, max-age=86400"
+    elif result.file_id:
+        etag, length, data = result.etag, result.length or 0, None
+    else:
+        # Pictures stored before GridFS are still kept inside the document
+        etag, length = hashlib.sha256(data).hexdigest(), len(data) # type: ignore
+    headers = {"ETag": f'"{etag}"', "Cache-Control": cache_control, "Accept-Ranges": "bytes"}
+
+    if (if_none_match := request.headers.get("If-None-Match")) and etag_matches(if_none_match, headers["ETag"]):
+        return Response(status_code= status.HTTP_304_NOT_MODIFIED, headers= headers)
+
+    start, end = 0, length - 1
+    status_code = status.HTTP_200_OK
+    if (range_header := request.headers.get("Range")) and (byte_range := parse_range(range_header, length)):
+        start, end = byte_range
+        # Only a range starting at or after the end of the picture is not satisfiable
+        if start > end:
+            return Response(status_code= status.HTTP_416_REQUESTED_RANGE_NOT_SATISFIABLE, headers= {"Content-Range": f"bytes */{length}"})
+        status_code = status.HTTP_206_PARTIAL_CONTENT
+        headers["Content-Range"] = f"bytes {start}-{end}/{length}"
+    headers["Content-Length"] = str(end - start + 1)
+
+    if data is None:
+        body = uSvc.read_picture(db.get_db(), result.file_id, result.chunk_size or uSvc.picture_chunk_size, start, end) # type: ignore
+    else:
+        body = iter([data[start : end + 1]])
+    return StreamingResponse(body, status_code, headers, media_type= content_type)
 
 @router.put("/user")
 @inject
@@ -68,19 +128,35 @@ async def update_password(db: db_dependency, password: str, email: Annotated[str
     else:
         return Response(status_code=status.HTTP_400_BAD_REQUEST)
 
-@router.get("/user/2fa")
+@router.post("/user/2fa")
 @inject
-async def get_2f_code(email: Annotated[str, Depends(oauth2_scheme)], totp: totp_dependency):
-    totp_code = await totp.now(email, is_value_ascii = True)
-    if totp_code:
-        return Response(content=totp_code, media_type="plain/text")
+async def enroll_2fa(db: db_dependency, email: Annotated[str, Depends(oauth2_scheme)], code: Optional[str] = None) -> TwoFactorEnrollment:
+    enrollment = await twofactor.start_enrollment(db.get_db(), email, code)
+    if enrollment:
+        return enrollment
     else:
-        return Response(status_code = status.HTTP_404_NOT_FOUND)
+        raise HTTPException(status_code = status.HTTP_404_NOT_FOUND)
+
+@router.post("/user/2fa/confirm")
+@inject
+async def confirm_2fa(db: db_dependency, code: str, email: Annotated[str, Depends(oauth2_scheme)]):
+    if await twofactor.confirm_enrollment(db.get_db(), email, code):
+        return Response(status_code = status.HTTP_200_OK)
+    else:
+        return Response(status_code = status.HTTP_400_BAD_REQUEST)
+
+@router.delete("/user/2fa")
+@inject
+async def disable_2fa(db: db_dependency, code: str, email: Annotated[str, Depends(oauth2_scheme)]):
+    if await twofactor.disable(db.get_db(), email, code):
+        return Response(status_code = status.HTTP_200_OK)
+    else:
+        return Response(status_code = status.HTTP_400_BAD_REQUEST)
 
 @router.get("/user/2fa-verify")
 @inject
-async def verify_2f_code(code: str, email: Annotated[str, Depends(oauth2_scheme)], totp: totp_dependency):
-    if await totp.verify(code, email, is_value_ascii = True):
+async def verify_2f_code(db: db_dependency, code: str, email: Annotated[str, Depends(oauth2_scheme)]):
+    if await twofactor.verify_code(db.get_db(), email, code):
         return Response(status_code = status.HTTP_200_OK)
     else:
         return Response(status_code = status.HTTP_401_UNAUTHORIZED)
@@ -113,7 +189,7 @@ async def update_address(db: db_dependency, address: Address, email: Annotated[s
 
 @router.post("/user/change-status")
 @inject
-async def change_status(db: db_dependency, user_status: bool, email: Annotated[str, Depends(verify_token_from_requests)]):
+async def change_status(db: db_dependency, user_status: bool, email: Annotated[str, Depends(oauth2_scheme)]):
         result = await uSvc.change_status(user_status, email, db.get_db())
         if result:
             return Response(status_code = status.HTTP_200_OK)
@@ -0,0 +1,13 @@
+from fastapi import APIRouter, Response
+
+from src.services.jwt_service import get_jwks
+
+router = APIRouter(
+    tags=["well-known"],
+    prefix="/.well-known"
+)
+
+# Public keys used to sign the tokens, consumers can verify them without calling /auth/validate-token
+@router.get("/jwks.json")
+async def jwks():
+    return Response(await get_jwks(), media_type = "application/json", headers = {"Cache-Control": "public, max-age=3600"})
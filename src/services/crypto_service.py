@@ -1,25 +1,98 @@
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
 from dependency_injector.wiring import Provide, inject
+from fastapi import HTTPException, status
 from passlib.context import CryptContext
 from cryptography.hazmat.primitives import serialization, hashes
 from cryptography.hazmat.backends import default_backend
 from cryptography.hazmat.primitives.asymmetric import padding
-import base64
+from cryptography.hazmat.primitives.ciphers.aead import AESGCM
+from cryptography.hazmat.primitives.kdf.hkdf import HKDF
+import asyncio, base64, os, time
 from log2mongo import log2mongo
 
+from src.services import metrics_service as metrics
+from src.services.tracing_service import traced
+
+pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+
+# Module level functions so they can be pickled and sent to a process pool
+def hash_password(password: str) -> str:
+    return pwd_context.hash(password)
+
+def verify_password_hash(plain_pwd: str, hashed_psw: str) -> bool:
+    return pwd_context.verify(plain_pwd, hashed_psw)
+
 class CryptoService:
     
     #@inject
-    def __init__(self, log: log2mongo) -> None:
+    def __init__(self, log: log2mongo, password_executor: str = "thread", password_workers: int = 2, password_max_queue: int = 32) -> None:
+        self.log = log
         self.private_key = self.get_private_key()
         self.public_key = self.get_public_key()
-        self.pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
-        self.log = log
+        self.claims_key = self.get_claims_key()
+        self.pwd_context = pwd_context
+        self.password_executor = password_executor
+        self.password_workers = password_workers
+        self.password_max_queue = password_max_queue
+        self.password_pending = 0
+        self.password_rejected = 0
+        self.executor: Executor | None = None
+
+    def get_executor(self) -> Executor | None:
+        # bcrypt releases the GIL, so threads are enough in most deployments,
+        # "process" is available when the hashing must not compete with the event loop at all
+        if self.executor is None:
+            if self.password_executor == "thread":
+                self.executor = ThreadPoolExecutor(max_workers= self.password_workers, thread_name_prefix= "bcrypt")
+            elif self.password_executor == "process":
+                self.executor = ProcessPoolExecutor(max_workers= self.password_workers)
+        return self.executor
+
+    async def run_password_job(self, func, *args):
+        start = time.perf_counter()
+        executor = self.get_executor()
+        if executor is None:
+            try:
+                return func(*args)
+            finally:
+                metrics.crypto_duration.observe((func.__name__,), time.perf_counter() - start)
+
+        # Jobs running plus jobs waiting, reject early instead of letting a login burst pile up
+        if self.password_pending >= self.password_workers + self.password_max_queue:
+            self.password_rejected += 1
+            raise HTTPException(
+                status_code= status.HTTP_503_SERVICE_UNAVAILABLE,
+                detail= "Server busy, try again later",
+                headers= {"Retry-After": "1"})
+
+        self.password_pending += 1
+        try:
+            return await asyncio.get_running_loop().run_in_executor(executor, func, *args)
+        finally:
+            self.password_pending -= 1
+            metrics.crypto_duration.observe((func.__name__,), time.perf_counter() - start)
+
+    def get_password_stats(self) -> dict:
+        return {
+            "executor": self.password_executor,
+            "workers": self.password_workers,
+            "max_queue": self.password_max_queue,
+            "pending": self.password_pending,
+            "rejected": self.password_rejected,
+        }
+
+    def shutdown(self):
+        if self.executor is not None:
+            self.executor.shutdown(wait=False, cancel_futures=True)
+            self.executor = None
     
+    @traced("crypto.password_hash")
     async def get_psw_hash(self, password: str):
-        return self.pwd_context.hash(password)
+        return await self.run_password_job(hash_password, password)
     
+    @traced("crypto.password_verify")
     async def verify_password(self, plain_pwd: str, hashed_psw: str):
-        return self.pwd_context.verify(plain_pwd, hashed_psw)
+        return await self.run_password_job(verify_password_hash, plain_pwd, hashed_psw)
 
     def get_private_key(self):
         try:
@@ -82,7 +155,55 @@ class CryptoService:
             self.log.logger.error(e)
             print(f"Error loading private key: {e}")
 
+    def get_claims_key(self):
+        # Symmetric key derived from the RSA private key, so no new secret has to be distributed
+        try:
+            if self.private_key is not None:
+                key_material = self.private_key.private_bytes(
+                    encoding=serialization.Encoding.DER,
+                    format=serialization.PrivateFormat.PKCS8,
+                    encryption_algorithm=serialization.NoEncryption()
+                )
+                hkdf = HKDF(
+                    algorithm=hashes.SHA256(),
+                    length=32,
+                    salt=None,
+                    info=b"auth-service jwt claims"
+                )
+                return AESGCM(hkdf.derive(key_material))
+        except Exception as e:
+            self.log.logger.error(e)
+            print(f"Error deriving claims key: {e}")
+
+    @traced("crypto.aesgcm_seal")
+    async def seal_text(self, text: str, associated_data: bytes | None = None):
+        start = time.perf_counter()
+        try:
+            nonce = os.urandom(12)
+            ciphertext = self.claims_key.encrypt(nonce, text.encode(), associated_data) # type: ignore
+            return str(base64.urlsafe_b64encode(nonce + ciphertext).rstrip(b"="), "utf8")
+        except Exception as e:
+            self.log.logger.error(e)
+            raise e
+        finally:
+            metrics.crypto_duration.observe(("aesgcm_seal",), time.perf_counter() - start)
+
+    @traced("crypto.aesgcm_open")
+    async def open_text(self, text: str, associated_data: bytes | None = None):
+        start = time.perf_counter()
+        try:
+            data = base64.urlsafe_b64decode(text + "=" * (-len(text) % 4))
+            plaintext = self.claims_key.decrypt(data[:12], data[12:], associated_data) # type: ignore
+            return str(plaintext, "utf8")
+        except Exception as e:
+            self.log.logger.error(e)
+            raise e
+        finally:
+            metrics.crypto_duration.observe(("aesgcm_open",), time.perf_counter() - start)
+
+    @traced("crypto.rsa_encrypt")
     async def encrypt_text(self, text: str):
+        start = time.perf_counter()
         try:
             public_key = self.public_key
             if public_key is not None:
@@ -99,8 +220,12 @@ class CryptoService:
         except Exception as e:
             self.log.logger.error(e)
             raise e
+        finally:
+            metrics.crypto_duration.observe(("rsa_encrypt",), time.perf_counter() - start)
     
+    @traced("crypto.rsa_decrypt")
     async def decrypt_text(self, text: str):
+        start = time.perf_counter()
         try:
             private_key = self.private_key
             plaintext = private_key.decrypt( # type: ignore
@@ -114,4 +239,6 @@ class CryptoService:
             return str(plaintext, "utf8")
         except Exception as e:
             self.log.logger.error(e)
-            raise e
\ No newline at end of file
+            raise e
+        finally:
+            metrics.crypto_duration.observe(("rsa_decrypt",), time.perf_counter() - start)
\ No newline at end of file
@@ -0,0 +1,42 @@
+from jwt import PyJWKSet
+from log2mongo import log2mongo
+import asyncio, httpx, json, time
+
+from src.services.task_service import BackgroundTask
+
+class GoogleJWKS(BackgroundTask):
+
+    def __init__(self, jwks_uri: str, jwks_file: str, refresh_seconds: int, http_client: httpx.AsyncClient, log: log2mongo) -> None:
+        self.jwks_uri = jwks_uri
+        # A local key set replaces Google's, used by tests and local environments
+        self.jwks_file = jwks_file
+        self.refresh_seconds = refresh_seconds
+        self.http_client = http_client
+        self.log = log
+        self.keys = {}
+        self.refreshed_at = 0.0
+
+    async def refresh(self):
+        try:
+            if self.jwks_file:
+                with open(self.jwks_file, "r") as f:
+                    jwks = json.load(f)
+            else:
+                response = await self.http_client.get(self.jwks_uri)
+                response.raise_for_status()
+                jwks = response.json()
+            self.keys = { key.key_id: key.key for key in PyJWKSet.from_dict(jwks).keys }
+            self.refreshed_at = time.monotonic()
+        except Exception as e:
+            self.log.logger.error(e)
+
+    async def get_key(self, kid: str | None):
+        if kid not in self.keys and time.monotonic() - self.refreshed_at > 60:
+            # Google rotated its keys before the next scheduled refresh
+            await self.refresh()
+        return self.keys.get(kid)
+
+    async def run(self):
+        while True:
+            await self.refresh()
+            await asyncio.sleep(self.refresh_seconds)
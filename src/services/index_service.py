@@ -0,0 +1,72 @@
+from dependency_injector.wiring import Provide, inject
+from pymongo import ASCENDING, IndexModel
+from pymongo.asynchronous.database import AsyncDatabase
+from log2mongo import log2mongo
+from dotenv import load_dotenv
+import os
+
+from src.dependency_injection.containers import Container
+
+log_service: log2mongo = Provide[Container.logging]
+load_dotenv()
+
+# Every lookup path used by the services must be covered by one of these indexes
+INDEXES: dict[str, list[IndexModel]] = {
+    str(os.environ["DB_USERS_COLLECTION"]): [
+        IndexModel([("email", ASCENDING)], name="email_unique", unique=True),
+        IndexModel([("address._id", ASCENDING)], name="address_id"),
+    ],
+    "Products": [
+        IndexModel([("name", ASCENDING)], name="name"),
+    ],
+    str(os.environ["DB_REFRESH_TOKENS_COLLECTION"]): [
+        IndexModel([("expires_at", ASCENDING)], name="expires_at_ttl", expireAfterSeconds=0),
+        IndexModel([("email", ASCENDING)], name="email"),
+        IndexModel([("family", ASCENDING)], name="family"),
+    ],
+    str(os.environ["DB_REVOKED_TOKENS_COLLECTION"]): [
+        IndexModel([("expires_at", ASCENDING)], name="expires_at_ttl", expireAfterSeconds=0),
+        IndexModel([("revoked_at", ASCENDING)], name="revoked_at"),
+    ],
+}
+
+def get_key(index: dict) -> tuple:
+    return tuple(index["key"].items())
+
+@inject
+async def get_indexes_report(db: AsyncDatabase, log = log_service) -> dict:
+    report = {}
+    try:
+        for collection, indexes in INDEXES.items():
+            existing = {}
+            async for index in await db[collection].list_indexes():
+                if index["name"] != "_id_":
+                    existing[get_key(index)] = index["name"]
+
+            expected = { get_key(index.document): index.document["name"] for index in indexes }
+            report[collection] = {
+                "missing": [name for key, name in expected.items() if key not in existing],
+                "extra": [name for key, name in existing.items() if key not in expected],
+            }
+    except Exception as e:
+        log.logger.error(e)
+    return report
+
+@inject
+async def ensure_indexes(db: AsyncDatabase, log = log_service) -> dict:
+    report = await get_indexes_report(db)
+    for collection, indexes in INDEXES.items():
+        missing = report.get(collection, {}).get("missing", [])
+        to_create = [index for index in indexes if index.document["name"] in missing]
+        if not to_create:
+            continue
+        try:
+            created = await db[collection].create_indexes(to_create)
+            log.logger.info(f"Indexes created on { collection }: { created }")
+        except Exception as e:
+            log.logger.error(e)
+
+    for collection, result in report.items():
+        if result["extra"]:
+            log.logger.info(f"Indexes on { collection } not declared by the service: { result['extra'] }")
+    return report
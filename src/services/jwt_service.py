@@ -4,17 +4,67 @@ from dependency_injector.wiring import Provide, inject
 from fastapi import HTTPException, Request
 from log2mongo import log2mongo
 from dotenv import load_dotenv
-import os, jwt
+import os, jwt, hashlib, uuid
 
+from src.models.token_model import Principal, TokenValidationResult
+from src.services.cache_service import LRUCache
 from src.services.crypto_service import CryptoService
+from src.services.signing_key_service import SigningKeyService
+from src.services.revocation_service import RevocationList
+from src.services.tracing_service import traced
 from src.dependency_injection.containers import Container
 
 crypto_service: CryptoService = Provide[Container.crypto_service]
+signing_key_service: SigningKeyService = Provide[Container.signing_keys]
+token_cache_service: LRUCache = Provide[Container.token_cache]
+revocation_service: RevocationList = Provide[Container.revocations]
 log_service: log2mongo = Provide[Container.logging]
 load_dotenv()
+# "rsa" encrypts every claim with the public key, "aesgcm" seals them with a key derived from the private key,
+# "none" leaves them readable, so services verifying the token with the JWKS also get the principal
+claims_encryption = os.environ["JWT_CLAIMS_ENCRYPTION"]
+# Tokens with an audience are rejected where an access token is expected, a challenge can not be used as one
+challenge_audience = "twofactor-challenge"
+
+async def encrypt_claim(claim: str, value: str, crypto: CryptoService):
+    if claims_encryption == "none":
+        return value
+    if claims_encryption == "aesgcm":
+        return await crypto.seal_text(value, claim.encode())
+    return await crypto.encrypt_text(value)
+
+async def decrypt_claim(payload: dict, claim: str, crypto: CryptoService):
+    # Tokens without the "enc" claim were issued in the RSA format, they are accepted until they expire
+    if payload.get("enc") == "none":
+        return payload.get(claim)
+    if payload.get("enc") == "aesgcm":
+        return await crypto.open_text(payload.get(claim), claim.encode()) # type: ignore
+    return await crypto.decrypt_text(payload.get(claim)) # type: ignore
+
+def encode_token(data: dict, keys: SigningKeyService):
+    if keys.is_symmetric():
+        return jwt.encode(data, str(os.environ["JWT_SECRET_KEY"]), algorithm= keys.algorithm)
+    return jwt.encode(data, keys.private_key, algorithm= keys.algorithm, headers= { "kid": keys.kid }) # type: ignore
+
+def decode_token(token: str, keys: SigningKeyService, audience: str | None = None):
+    if keys.is_symmetric():
+        return jwt.decode(token, str(os.environ["JWT_SECRET_KEY"]), [keys.algorithm], audience= audience)
+
+    kid = jwt.get_unverified_header(token).get("kid")
+    # Tokens issued before moving to asymmetric signing have no kid, they are accepted while JWT_SECRET_KEY is set
+    if kid is None and os.environ["JWT_SECRET_KEY"]:
+        return jwt.decode(token, str(os.environ["JWT_SECRET_KEY"]), ["HS256", "HS384", "HS512"], audience= audience)
+    if (public_key := keys.get_public_key(kid)) is None:
+        raise jwt.InvalidTokenError(f"Unknown signing key: {kid}")
+    return jwt.decode(token, public_key, [keys.algorithm], audience= audience)
+
+@inject
+async def get_jwks(keys = signing_key_service):
+    return keys.jwks_json
 
 @inject
-async def create_token(data: dict, expire_time: timedelta = timedelta(minutes=int(str(os.environ["JWT_EXPIRE_MINUTES"]))), crypto = crypto_service, log = log_service):
+@traced("jwt.create_token")
+async def create_token(data: dict, expire_time: timedelta = timedelta(minutes=int(str(os.environ["JWT_EXPIRE_MINUTES"]))), crypto = crypto_service, keys = signing_key_service, log = log_service):
     try:
         for item in data:
             if isinstance(data[item], list):
@@ -22,30 +72,91 @@ async def create_token(data: dict, expire_time: timedelta = timedelta(minutes=in
                     # To encrypt the roles use the commented code
                     data[item][x] = data[item][x] #await crypto.encrypt_text(data[item][x])
             else:
-                data[item] = await crypto.encrypt_text(data[item])
+                data[item] = await encrypt_claim(item, data[item], crypto)
 
-        expire = datetime.now(timezone.utc) + expire_time
-        data.update({ "exp": expire })
-        encode_jwt = jwt.encode(data, str(os.environ["JWT_SECRET_KEY"]), algorithm= os.environ["JWT_ALGORITHM"])
+        if claims_encryption in ("aesgcm", "none"):
+            data.update({ "enc": claims_encryption })
+        now = datetime.now(timezone.utc)
+        # jti identifies the token in the revocation list, iat tells if it predates a revocation of the user.
+        # iat is a float, a datetime would be truncated to the second and a sign-in right after a revocation would be rejected
+        data.update({ "jti": uuid.uuid4().hex, "iat": now.timestamp(), "exp": now + expire_time })
+        encode_jwt = encode_token(data, keys)
         return encode_jwt
     except Exception as e:
         log.logger.error(e)
         raise e
     
 @inject
-async def verify_token(token: str, crypto = crypto_service, log = log_service):
+async def create_challenge_token(email: str, crypto = crypto_service, keys = signing_key_service):
+    data = { "sub": await encrypt_claim("sub", email, crypto), "aud": challenge_audience }
+    if claims_encryption in ("aesgcm", "none"):
+        data.update({ "enc": claims_encryption })
+    data.update({ "exp": datetime.now(timezone.utc) + timedelta(minutes=int(os.environ["TOTP_CHALLENGE_MINUTES"])) })
+    return encode_token(data, keys)
+
+@inject
+async def verify_challenge_token(token: str, crypto = crypto_service, keys = signing_key_service, log = log_service) -> str:
+    try:
+        payload = decode_token(token, keys, challenge_audience)
+        return await decrypt_claim(payload, "sub", crypto)
+    except jwt.InvalidTokenError as e:
+        log.logger.error(e)
+        raise HTTPException(status_code=401, detail="Invalid credentials")
+
+@inject
+@traced("jwt.verify_and_decrypt")
+async def verify_and_decrypt(token: str, crypto = crypto_service, token_cache = token_cache_service, revocations = revocation_service):
+    # The decoded payload and the decrypted email are kept until the token expires,
+    # so a token is decoded and RSA decrypted only once per process
+    key = hashlib.sha256(token.encode()).digest()
+    if (cached := token_cache.get(key)) is not None:
+        payload, email = cached
+    else:
+        payload = await verify(token)
+        email = await decrypt_claim(payload, "sub", crypto)
+        token_cache.set(key, (payload, email), payload.get("exp"))
+
+    # In memory lookup, cached tokens are checked too since they can be revoked after being cached
+    if revocations.is_revoked(payload, email):
+        raise HTTPException(status_code=401, detail="Invalid credentials")
+    return payload, email
+
+async def get_principal(token: str) -> Principal:
+    payload, email = await verify_and_decrypt(token)
+    return Principal(email = email, roles = payload.get("roles", []), exp = payload.get("exp"), jti = payload.get("jti"))
+
+async def get_request_principal(request: Request) -> Principal:
+    # Request scoped, set by JWTMiddleware or by the first dependency that needs it,
+    # every other dependency of the same request reuses it without decoding the token again
+    if (principal := getattr(request.state, "principal", None)) is None:
+        scheme, _, token = request.headers.get("Authorization", "").partition(" ")
+        if scheme.lower() != "bearer" or not token:
+            raise HTTPException(status_code=401, detail="Not authenticated", headers={"WWW-Authenticate": "Bearer"})
+        principal = await get_principal(token)
+        request.state.principal = principal
+    return principal
+
+def check_roles(principal: Principal, required_roles: list[str]):
+    if not set(required_roles) & set(principal.roles):
+        raise HTTPException(status_code=401, detail="Insufficient permissions")
+
+@inject
+async def get_token_cache_stats(token_cache = token_cache_service):
+    return token_cache.get_stats()
+
+@inject
+async def verify_token(token: str, log = log_service):
         try:
-            payload = await verify(token)
-            return await crypto.decrypt_text(payload.get("sub"))
+            payload, email = await verify_and_decrypt(token)
+            return email
         except Exception as e:
             log.logger.error(e)
             raise e
         
 @inject
-async def verify_token_and_roles(token: str, required_roles: Optional[list[str]] = None, crypto = crypto_service, log = log_service):
+async def verify_token_and_roles(token: str, required_roles: Optional[list[str]] = None, log = log_service):
         try:
-            payload = await verify(token)
-            email = await crypto.decrypt_text(payload.get("sub"))
+            payload, email = await verify_and_decrypt(token)
             if required_roles:
                 roles = payload.get('roles', [])
 
@@ -58,23 +169,39 @@ async def verify_token_and_roles(token: str, required_roles: Optional[list[str]]
             log.logger.error(e)
             raise e
     
-#async def verify_token(Authorization: str = Header(...)) -> bool:
-async def verify_token_from_requests(request: Request):
+@inject
+async def verify_tokens(tokens: list[str], log = log_service) -> list[TokenValidationResult]:
+    # Identical tokens in the same batch are verified only once
+    results: dict[str, TokenValidationResult] = {}
+    for token in tokens:
+        if token in results:
+            continue
         try:
-            email = ""
-            if(request_token := request.headers.get("Authorization")) is not None:
-                request_token = request_token.replace("Bearer ", "")
-                payload = await verify(request_token)
-                email = await crypto_service.decrypt_text(payload.get("sub"))
-            return email
+            payload, email = await verify_and_decrypt(token)
+            results[token] = TokenValidationResult(
+                valid = True,
+                email = email,
+                roles = payload.get("roles", []),
+                expires_at = datetime.fromtimestamp(payload["exp"], timezone.utc) if "exp" in payload else None)
+        except HTTPException as e:
+            results[token] = TokenValidationResult(error = e.detail)
         except Exception as e:
-            #log.logger.error(e)
-            raise e
+            log.logger.error(e)
+            results[token] = TokenValidationResult(error = "Invalid token")
+    return [results[token] for token in tokens]
+
+#async def verify_token(Authorization: str = Header(...)) -> bool:
+async def verify_token_from_requests(request: Request):
+        if request.headers.get("Authorization") is None:
+            return ""
+        principal = await get_request_principal(request)
+        return principal.email
 
 @inject
-async def verify(request_token: str, log = log_service):
+@traced("jwt.verify")
+async def verify(request_token: str, keys = signing_key_service, log = log_service):
         try:
-            payload = jwt.decode(request_token, str(os.environ["JWT_SECRET_KEY"]), os.environ["JWT_ALGORITHM"])
+            payload = decode_token(request_token, keys)
             return payload
         except jwt.ExpiredSignatureError as e:
             log.logger.error(e)
@@ -87,10 +214,10 @@ async def verify(request_token: str, log = log_service):
             raise e
 
 @inject
-async def get_email(token: str, crypto = crypto_service, log = log_service):
+async def get_email(token: str, crypto = crypto_service, keys = signing_key_service, log = log_service):
     try:
-        payload = jwt.decode(token, str(os.environ["JWT_SECRET_KEY"]), os.environ["JWT_ALGORITHM"])
-        return await crypto.decrypt_text(payload.get("sub"))
+        payload = decode_token(token, keys)
+        return await decrypt_claim(payload, "sub", crypto)
     except Exception as e:
         log.logger.error(e)
         raise e
@@ -0,0 +1,106 @@
+from collections import deque
+from datetime import datetime, timezone
+from pymongo import AsyncMongoClient
+from pymongo.server_api import ServerApi
+import asyncio, logging
+
+class BufferedMongoHandler(logging.Handler):
+
+    def __init__(self, max_queue: int, batch_size: int, level: int | str = 0) -> None:
+        super().__init__(level)
+        self.records: deque = deque()
+        self.max_queue = max_queue
+        self.batch_size = batch_size
+        self.loop: asyncio.AbstractEventLoop | None = None
+        self.wake: asyncio.Event | None = None
+        self.queued = 0
+        self.dropped = 0
+
+    def emit(self, record):
+        size = len(self.records)
+        # Under overload the records below WARNING are dropped first, errors only when the queue is full
+        if size >= self.max_queue or (record.levelno < logging.WARNING and size >= self.max_queue // 2):
+            self.dropped += 1
+            return
+
+        # Same document written by log2mongo, the collection is the level name
+        self.records.append((record.levelname.lower(), {
+            "timestamp": datetime.fromtimestamp(record.created, timezone.utc),
+            "name": record.name,
+            "level": record.levelname,
+            "message": record.getMessage(),
+            "module": record.module,
+            "function": record.funcName,
+            "line": record.lineno,
+            "path": record.pathname
+        }))
+        self.queued += 1
+        if size + 1 == self.batch_size and self.loop is not None and self.wake is not None:
+            self.loop.call_soon_threadsafe(self.wake.set)
+
+# Drop-in replacement of log2mongo, records are written with insert_many from a background task
+# instead of one synchronous insert per call on the request path
+class BufferedMongoLogger:
+
+    def __init__(self, db_url: str, db_name: str, level: int | str = 40, max_queue: int = 10000, batch_size: int = 500, flush_interval: float = 2) -> None:
+        self.client = AsyncMongoClient(db_url, server_api= ServerApi(version='1', strict=True, deprecation_errors=True))
+        self.database = self.client.get_database(db_name)
+        self.flush_interval = flush_interval
+        self.handler = BufferedMongoHandler(max_queue, batch_size, level)
+        self.logger = logging.getLogger(__name__)
+        self.logger.handlers.clear()
+        self.logger.setLevel(level)
+        self.logger.addHandler(self.handler)
+        self.task: asyncio.Task | None = None
+        self.stopping = False
+        self.flushed = 0
+        self.failed = 0
+
+    def start(self):
+        self.handler.loop = asyncio.get_running_loop()
+        self.handler.wake = asyncio.Event()
+        self.task = asyncio.create_task(self.run())
+
+    async def run(self):
+        while not self.stopping:
+            try:
+                await asyncio.wait_for(self.handler.wake.wait(), self.flush_interval) # type: ignore
+            except asyncio.TimeoutError:
+                pass
+            self.handler.wake.clear() # type: ignore
+            await self.flush()
+
+    async def flush(self):
+        records = self.handler.records
+        while records:
+            collections: dict[str, list] = {}
+            for _ in range(min(self.handler.batch_size, len(records))):
+                collection, document = records.popleft()
+                collections.setdefault(collection, []).append(document)
+
+            for collection, documents in collections.items():
+                try:
+                    await self.database[collection].insert_many(documents, ordered=False)
+                    self.flushed += len(documents)
+                except Exception as e:
+                    self.failed += len(documents)
+                    print(f"Error writing logs: { e }")
+
+    async def stop(self):
+        # Everything queued before the shutdown is written
+        self.stopping = True
+        if self.task is not None:
+            self.handler.wake.set() # type: ignore
+            await self.task
+            self.task = None
+        await self.flush()
+        await self.client.close()
+
+    def get_stats(self) -> dict:
+        return {
+            "queued": self.handler.queued,
+            "pending": len(self.handler.records),
+            "dropped": self.handler.dropped,
+            "flushed": self.flushed,
+            "failed": self.failed,
+        }
@@ -1,38 +1,80 @@
 from dependency_injector.wiring import Provide, inject
+from fastapi import HTTPException
 from log2mongo import log2mongo
 
 from src.services.user_service import get_user
-from src.services.jwt_service import create_token
-from src.models.token_model import Token
+from src.services.jwt_service import create_challenge_token, create_token
+from src.services.twofactor_service import verify_code
+from src.services.refresh_token_service import issue_refresh_token, rotate_refresh_token
+from src.models.token_model import Token, TwoFactorChallenge
+from src.models.user_model import User
 from src.services.crypto_service import CryptoService
 from src.dependency_injection.containers import Container
 
 crypto_service: CryptoService = Provide[Container.crypto_service]
 logger: log2mongo = Provide[Container.logging]
 
+async def get_tokens(user: User, db, refresh_token: str | None = None) -> Token:
+    token = await create_token({ "sub": user.email, "name": user.name, "roles": user.roles })
+    if refresh_token is None:
+        refresh_token = await issue_refresh_token(db, user.email)
+    return Token(access_token = token, token_type = "bearer", refresh_token = refresh_token)
+
 @inject
 async def login(username: str, password: str, db, crypto = crypto_service, log = logger):
     try:
-        user = await get_user(username, db)
+        user = await get_user(username, db, fresh = True)
         if user is not None:
             is_password_valid = await crypto.verify_password(password, user.password)
             if not user.email_verified:
                 return True, None
             if is_password_valid and not user.disabled:
-                token = await create_token({ "sub": user.email, "name": user.name, "roles": user.roles })
-                return True, Token(access_token = token, token_type = "bearer")
+                # The access token is only issued after the second factor, see login_second_factor
+                if user.twofactor_enabled:
+                    return True, TwoFactorChallenge(challenge_token = await create_challenge_token(user.email))
+                return True, await get_tokens(user, db)
+    except HTTPException as e:
+        raise e
     except Exception as e:
         log.logger.error(e)
     return False, None
 
 @inject
-async def external_login(username: str, issuer: str, db, crypto = crypto_service, log = logger):
+async def login_second_factor(email: str, code: str, db, log = logger):
+    # The email comes from a challenge token already verified with verify_challenge_token
+    try:
+        user = await get_user(email, db, fresh = True)
+        if user is not None and user.twofactor_enabled and not user.disabled and await verify_code(db, email, code):
+            return await get_tokens(user, db)
+    except HTTPException as e:
+        raise e
+    except Exception as e:
+        log.logger.error(e)
+    return None
+
+@inject
+async def external_login(username: str, issuer: str, db, user: User | None = None, crypto = crypto_service, log = logger):
     try:
-        user = await get_user(username, db)
+        user = user if user is not None else await get_user(username, db, fresh = True)
         if user:
             if user.issuer == issuer:
-                token = await create_token({ "sub": user.email, "name": user.name, "roles": user.roles })
-                return True, Token(access_token = token, token_type = "bearer")
+                # The Google sign-in does not replace the second factor, it is completed on /auth/sign-in/2fa
+                if user.twofactor_enabled:
+                    return True, TwoFactorChallenge(challenge_token = await create_challenge_token(user.email))
+                return True, await get_tokens(user, db)
     except Exception as e:
         log.logger.error(e)
     return False, None
+
+@inject
+async def refresh(refresh_token: str, db, log = logger):
+    try:
+        # The access token is renewed without the password, the refresh token is replaced by a new one
+        if (rotated := await rotate_refresh_token(db, refresh_token)) is not None:
+            email, new_refresh_token = rotated
+            user = await get_user(email, db, fresh = True)
+            if user is not None and not user.disabled:
+                return await get_tokens(user, db, new_refresh_token)
+    except Exception as e:
+        log.logger.error(e)
+    return None
@@ -0,0 +1,81 @@
+from bisect import bisect_left
+
+# Minimal Prometheus text format instruments, every series is created once and then only its counters change
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+def format_labels(names: tuple[str, ...], values: tuple, extra: str = "") -> str:
+    labels = [f'{name}="{value}"' for name, value in zip(names, values)]
+    if extra:
+        labels.append(extra)
+    return "{" + ",".join(labels) + "}" if labels else ""
+
+class Counter:
+
+    def __init__(self, name: str, description: str, labels: tuple[str, ...] = ()) -> None:
+        self.name = name
+        self.description = description
+        self.labels = labels
+        self.series: dict[tuple, float] = {}
+
+    def inc(self, labels: tuple = (), value: float = 1) -> None:
+        self.series[labels] = self.series.get(labels, 0) + value
+
+    def render(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.description}", f"# TYPE {self.name} counter"]
+        lines += [f"{self.name}{format_labels(self.labels, k)} {v}" for k, v in self.series.items()]
+        return lines
+
+class Gauge(Counter):
+
+    def dec(self, labels: tuple = (), value: float = 1) -> None:
+        self.series[labels] = self.series.get(labels, 0) - value
+
+    def render(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.description}", f"# TYPE {self.name} gauge"]
+        lines += [f"{self.name}{format_labels(self.labels, k)} {v}" for k, v in self.series.items()]
+        return lines
+
+class Histogram:
+
+    def __init__(self, name: str, description: str, labels: tuple[str, ...] = (), buckets: tuple[float, ...] = DEFAULT_BUCKETS) -> None:
+        self.name = name
+        self.description = description
+        self.labels = labels
+        self.buckets = buckets
+        # Per series: one count per bucket, the +Inf bucket, the sum and the total count
+        self.series: dict[tuple, list] = {}
+
+    def observe(self, labels: tuple, value: float) -> None:
+        if (series := self.series.get(labels)) is None:
+            series = self.series[labels] = [0] * (len(self.buckets) + 1) + [0.0, 0]
+        series[bisect_left(self.buckets, value)] += 1
+        series[-2] += value
+        series[-1] += 1
+
+    def render(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.description}", f"# TYPE {self.name} histogram"]
+        for k, series in self.series.items():
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), series):
+                cumulative += count
+                le = 'le="+Inf"' if bound == float("inf") else f'le="{bound}"'
+                lines.append(f"{self.name}_bucket{format_labels(self.labels, k, le)} {cumulative}")
+            lines.append(f"{self.name}_sum{format_labels(self.labels, k)} {series[-2]}")
+            lines.append(f"{self.name}_count{format_labels(self.labels, k)} {series[-1]}")
+        return lines
+
+http_requests = Counter("http_requests_total", "HTTP requests by route and status code", ("method", "route", "status"))
+http_duration = Histogram("http_request_duration_seconds", "HTTP request latency", ("method", "route"))
+http_in_flight = Gauge("http_requests_in_flight", "HTTP requests being processed")
+mongo_duration = Histogram("mongo_command_duration_seconds", "MongoDB command latency", ("command",))
+mongo_failures = Counter("mongo_command_failures_total", "MongoDB commands that failed", ("command",))
+crypto_duration = Histogram("crypto_operation_duration_seconds", "Crypto and password hashing latency, password jobs include the time waiting for a worker", ("operation",))
+rate_limited = Counter("sign_in_rate_limited_total", "Sign-in attempts rejected by the rate limiter", ("key",))
+
+instruments = [http_requests, http_duration, http_in_flight, mongo_duration, mongo_failures, crypto_duration, rate_limited]
+
+def render() -> str:
+    lines = []
+    for instrument in instruments:
+        lines += instrument.render()
+    return "\n".join(lines) + "\n"
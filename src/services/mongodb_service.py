@@ -1,15 +1,102 @@
 from pymongo import AsyncMongoClient
 from pymongo import MongoClient
+from pymongo import monitoring
 from pymongo.server_api import ServerApi
 from pymongo.asynchronous.database import AsyncDatabase
 from pymongo.database import Database
 import uuid
 
+from src.services import metrics_service as metrics
+from src.services import tracing_service as tracing
+
+class PoolMetrics(monitoring.ConnectionPoolListener):
+
+    def __init__(self) -> None:
+        self.connections_created = 0
+        self.connections_closed = 0
+        self.checkouts_started = 0
+        self.checkouts = 0
+        self.checkouts_failed = 0
+        self.checkins = 0
+        self.wait_seconds = 0.0
+        self.max_wait_seconds = 0.0
+
+    def get_stats(self) -> dict:
+        return {
+            "connections_created": self.connections_created,
+            "connections_closed": self.connections_closed,
+            "connections_open": self.connections_created - self.connections_closed,
+            "checkouts": self.checkouts,
+            "checkouts_failed": self.checkouts_failed,
+            "checked_out": self.checkouts - self.checkins,
+            "waiting": self.checkouts_started - self.checkouts - self.checkouts_failed,
+            "wait_seconds_total": self.wait_seconds,
+            "wait_seconds_max": self.max_wait_seconds,
+        }
+
+    def connection_created(self, event):
+        self.connections_created += 1
+
+    def connection_closed(self, event):
+        self.connections_closed += 1
+
+    def connection_check_out_started(self, event):
+        self.checkouts_started += 1
+
+    def connection_checked_out(self, event):
+        self.checkouts += 1
+        # Time spent waiting for a connection from the pool
+        self.wait_seconds += event.duration
+        self.max_wait_seconds = max(self.max_wait_seconds, event.duration)
+
+    def connection_check_out_failed(self, event):
+        self.checkouts_failed += 1
+
+    def connection_checked_in(self, event):
+        self.checkins += 1
+
+    def pool_created(self, event):
+        pass
+
+    def pool_ready(self, event):
+        pass
+
+    def pool_cleared(self, event):
+        pass
+
+    def pool_closed(self, event):
+        pass
+
+    def connection_ready(self, event):
+        pass
+
+class CommandMetrics(monitoring.CommandListener):
+
+    def started(self, event):
+        pass
+
+    def succeeded(self, event):
+        metrics.mongo_duration.observe((event.command_name,), event.duration_micros / 1_000_000)
+
+    def failed(self, event):
+        metrics.mongo_duration.observe((event.command_name,), event.duration_micros / 1_000_000)
+        metrics.mongo_failures.inc((event.command_name,))
+
 class MongoAsyncService:
 
-    def __init__(self, mongo_url: str, db_name: str) -> None:
+    def __init__(self, mongo_url: str, db_name: str, max_pool_size: int = 100, min_pool_size: int = 0, wait_queue_timeout_ms: int | None = None, compressors: list[str] | None = None) -> None:
         try:
-            self.client = AsyncMongoClient(mongo_url, server_api= ServerApi(version='1', strict=True, deprecation_errors=True))
+            self.pool_metrics = PoolMetrics()
+            options = {
+                "maxPoolSize": max_pool_size,
+                "minPoolSize": min_pool_size,
+                "waitQueueTimeoutMS": wait_queue_timeout_ms,
+                "event_listeners": [self.pool_metrics, CommandMetrics()] + tracing.get_command_listeners(),
+            }
+            # zstd and snappy need their own packages (zstandard, python-snappy)
+            if compressors:
+                options["compressors"] = compressors
+            self.client = AsyncMongoClient(mongo_url, server_api= ServerApi(version='1', strict=True, deprecation_errors=True), **options)
             self.database = self.client.get_database(db_name)
             self.id = uuid.uuid4()
         except Exception as e:
@@ -17,6 +104,9 @@ class MongoAsyncService:
         
     def get_db(self) -> AsyncDatabase:
         return self.database
+
+    def get_pool_stats(self) -> dict:
+        return self.pool_metrics.get_stats()
                 
     async def close_db(self):
         try:
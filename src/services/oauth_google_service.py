@@ -1,23 +1,37 @@
 import os
+import httpx, jwt
+from urllib.parse import parse_qs, urlparse
 import google.oauth2.credentials
 from log2mongo import log2mongo
 import google_auth_oauthlib.flow
 from dependency_injector.wiring import Provide, inject
+from dotenv import load_dotenv
 
+from src.services.google_jwks_service import GoogleJWKS
 from src.dependency_injection.containers import Container
 
 log_service: log2mongo = Provide[Container.logging]
+http_client_service: httpx.AsyncClient = Provide[Container.http_client]
+google_jwks_service: GoogleJWKS = Provide[Container.google_jwks]
+load_dotenv()
+
+# Built once, the values only change with the environment
+scopes = os.environ["GOOGLE_OAUTH_SCOPES"].split(',') if os.environ["GOOGLE_OAUTH_SCOPES"] else []
+client_config = {"web":{"client_id":os.environ["GOOGLE_OAUTH_CLIENT"],"project_id":os.environ["GOOGLE_OAUTH_ID"],"auth_uri":"https://accounts.google.com/o/oauth2/auth","token_uri":os.environ["GOOGLE_OAUTH_TOKEN_URI"],"auth_provider_x509_cert_url":"https://www.googleapis.com/oauth2/v1/certs","client_secret":os.environ["GOOGLE_OAUTH_SECRET"],"javascript_origins":os.environ["GOOGLE_OAUTH_JS_ORIGINS"].split(',') if os.environ["GOOGLE_OAUTH_JS_ORIGINS"] else []}}
+flow: google_auth_oauthlib.flow.Flow | None = None
+google_issuers = ["accounts.google.com", "https://accounts.google.com"]
+
+def get_flow() -> google_auth_oauthlib.flow.Flow:
+    global flow
+    if flow is None:
+        flow = google_auth_oauthlib.flow.Flow.from_client_config(client_config, scopes = scopes)
+        flow.redirect_uri = os.environ["GOOGLE_OAUTH_REDIRECT_RESPONSE"]
+    return flow
 
 @inject
 async def get_auth_url(log = log_service):
     try:
-        flow = google_auth_oauthlib.flow.Flow.from_client_config(
-            {"web":{"client_id":os.environ["GOOGLE_OAUTH_CLIENT"],"project_id":os.environ["GOOGLE_OAUTH_ID"],"auth_uri":"https://accounts.google.com/o/oauth2/auth","token_uri":"https://oauth2.googleapis.com/token","auth_provider_x509_cert_url":"https://www.googleapis.com/oauth2/v1/certs","client_secret":os.environ["GOOGLE_OAUTH_SECRET"],"javascript_origins":os.environ["GOOGLE_OAUTH_JS_ORIGINS"].split(',') if os.environ["GOOGLE_OAUTH_JS_ORIGINS"] else []}},
-            scopes = os.environ["GOOGLE_OAUTH_SCOPES"].split(',') if os.environ["GOOGLE_OAUTH_SCOPES"] else []
-        )
-        flow.redirect_uri = os.environ["GOOGLE_OAUTH_REDIRECT_RESPONSE"]
-
-        auth_url , state = flow.authorization_url(
+        auth_url , state = get_flow().authorization_url(
             acces_type = 'offline',
             include_grand_scopes = 'true',
             prompt = 'consent'
@@ -29,19 +43,47 @@ async def get_auth_url(log = log_service):
         log.logger.error(e)
 
 @inject
-async def get_auth_response(url: str, log = log_service):
+async def get_auth_response(url: str, http_client = http_client_service, log = log_service):
     try:
         credentials = None
-        flow = google_auth_oauthlib.flow.Flow.from_client_config(
-            {"web":{"client_id":os.environ["GOOGLE_OAUTH_CLIENT"],"project_id":os.environ["GOOGLE_OAUTH_ID"],"auth_uri":"https://accounts.google.com/o/oauth2/auth","token_uri":"https://oauth2.googleapis.com/token","auth_provider_x509_cert_url":"https://www.googleapis.com/oauth2/v1/certs","client_secret":os.environ["GOOGLE_OAUTH_SECRET"],"javascript_origins":os.environ["GOOGLE_OAUTH_JS_ORIGINS"].split(',') if os.environ["GOOGLE_OAUTH_JS_ORIGINS"] else []}},
-            scopes = os.environ["GOOGLE_OAUTH_SCOPES"].split(',') if os.environ["GOOGLE_OAUTH_SCOPES"] else []
-        )
-        flow.redirect_uri = os.environ["GOOGLE_OAUTH_REDIRECT_RESPONSE"]
+        query = parse_qs(urlparse(url).query)
+        if "code" not in query:
+            log.logger.error(f"Google authorization failed: { query.get('error') }")
+            return credentials
+
+        # Same request made by Flow.fetch_token, but without blocking the event loop
+        web = client_config["web"]
+        response = await http_client.post(web["token_uri"], data = {
+            "grant_type": "authorization_code",
+            "code": query["code"][0],
+            "client_id": web["client_id"],
+            "client_secret": web["client_secret"],
+            "redirect_uri": os.environ["GOOGLE_OAUTH_REDIRECT_RESPONSE"],
+        })
+        response.raise_for_status()
+        token = response.json()
 
-        auth_reponse = flow.fetch_token(authorization_response = url)
-        credentials = flow.credentials
+        credentials = google.oauth2.credentials.Credentials(
+            token = token.get("access_token"),
+            refresh_token = token.get("refresh_token"),
+            id_token = token.get("id_token"),
+            token_uri = web["token_uri"],
+            client_id = web["client_id"],
+            client_secret = web["client_secret"],
+            scopes = token.get("scope", "").split() or scopes
+        )
 
     except Exception as e:
         log.logger.error(e)
     finally:
-        return credentials
\ No newline at end of file
+        return credentials
+
+@inject
+async def verify_id_token(id_token: str, jwks = google_jwks_service) -> dict:
+    kid = jwt.get_unverified_header(id_token).get("kid")
+    if (key := await jwks.get_key(kid)) is None:
+        raise jwt.InvalidTokenError(f"Unknown Google signing key: {kid}")
+    claims = jwt.decode(id_token, key, algorithms = ["RS256"], audience = client_config["web"]["client_id"])
+    if claims.get("iss") not in google_issuers:
+        raise jwt.InvalidIssuerError("Invalid issuer")
+    return claims
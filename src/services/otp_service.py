@@ -16,27 +16,28 @@ class OTP():
         else:
             return base64.b32decode(value, casefold=True)
     
+    # Keyed HMAC without a message, copies of it skip the key preparation on every code
+    def get_hasher(self, key: bytes, digest: str):
+        return hmac.new(key, digestmod=digest)
+
+    def generate_from_hasher(self, hasher, moving_factor: int, return_digits: int) -> str:
+        hasher = hasher.copy()
+        hasher.update(struct.pack('>Q', moving_factor))
+        hmac_hash = hasher.digest()
+        offset = hmac_hash[-1] & 0xF
+        bin_code = (
+            (hmac_hash[offset] & 0x7F) << 24 |
+            (hmac_hash[offset + 1] & 0xFF) << 16 |
+            (hmac_hash[offset + 2] & 0xFF) << 8 |
+            (hmac_hash[offset + 3] & 0xFF)
+        )
+        return str(bin_code)[-return_digits :].rjust(return_digits, "0")
+
     def generate_OPT(self, secret: str, moving_factor: int, return_digits: int, digest: str, is_secret_ascii: bool = False, is_secret_hex: bool = False):
         otp_code = ""
         try:
-            msg = struct.pack('>Q', moving_factor)
             key = self.to_bytes(secret, is_secret_ascii, is_secret_hex)
-            hasher = self.get_hmac_sha(key, msg, digest)
-            #hasher_hex = hasher.hexdigest()
-            #hmac_hash = bytes.fromhex(hasher_hex)
-            hmac_hash = bytearray(hasher.digest())
-            offset = hmac_hash[-1] & 0xF
-            bin_code = (
-                (hmac_hash[offset] & 0x7F) << 24 |
-                (hmac_hash[offset + 1] & 0xFF) << 16 |
-                (hmac_hash[offset + 2] & 0xFF) << 8 |
-                (hmac_hash[offset + 3] & 0xFF)
-            )
-            otp_code = str(bin_code)[-return_digits :]
-
-            while (otp_code.__len__() < return_digits):
-                otp_code = "0" + otp_code
-
+            otp_code = self.generate_from_hasher(self.get_hasher(key, digest), moving_factor, return_digits)
         except Exception as e:
             raise e
         return otp_code
\ No newline at end of file
@@ -0,0 +1,93 @@
+from log2mongo import log2mongo
+import math, time
+
+from src.services import metrics_service as metrics
+from src.services.cache_service import LRUCache, close_redis_client, create_redis_client
+
+class RateLimiter:
+
+    def __init__(self, backend: str, ip_limit: int, ip_window: int, username_limit: int, username_window: int, max_keys: int, redis_url: str, log: log2mongo) -> None:
+        self.backend = backend
+        self.limits = { "ip": (ip_limit, ip_window), "username": (username_limit, username_window) }
+        self.log = log
+        # One token bucket per key, the least recently used ones are dropped when there are too many
+        self.buckets = LRUCache(max_keys)
+        self.redis = create_redis_client(redis_url) if backend == "redis" else None
+        self.allowed = 0
+        self.limited = { "ip": 0, "username": 0 }
+        self.errors = 0
+
+    def is_enabled(self) -> bool:
+        return self.backend in ("memory", "redis")
+
+    def take_token(self, key: str, limit: int, window: int) -> float:
+        # The bucket holds up to limit attempts and refills at limit / window attempts per second
+        now = time.time()
+        rate = limit / window
+        tokens, updated = self.buckets.get(key) or (limit, now)
+        tokens = min(limit, tokens + (now - updated) * rate)
+        if tokens < 1:
+            self.buckets.set(key, (tokens, now), now + window)
+            return (1 - tokens) / rate
+        self.buckets.set(key, (tokens - 1, now), now + window)
+        return 0
+
+    async def take_shared(self, key: str, limit: int, window: int) -> float:
+        # Fixed window counter, every worker increments the same key. The key is created with its
+        # expiration in the same MULTI as the increment, so it can never be left without one
+        async with self.redis.pipeline(transaction=True) as pipe: # type: ignore
+            pipe.set(key, 0, ex=window, nx=True)
+            pipe.incr(key)
+            pipe.ttl(key)
+            _, count, ttl = await pipe.execute()
+        if count > limit:
+            return max(ttl, 1)
+        return 0
+
+    async def acquire(self, ip: str, username: str) -> int:
+        # Returns 0 when the attempt is allowed, otherwise the seconds to wait before the next one
+        if not self.is_enabled():
+            return 0
+        for scope, value in (("ip", ip), ("username", username)):
+            limit, window = self.limits[scope]
+            key = f"rate:{scope}:{value}"
+            try:
+                retry_after = await self.take_shared(key, limit, window) if self.redis is not None else self.take_token(key, limit, window)
+            except Exception as e:
+                # The limiter fails open, a Redis outage must not block every sign-in
+                self.errors += 1
+                self.log.logger.error(e)
+                continue
+            if retry_after > 0:
+                self.limited[scope] += 1
+                metrics.rate_limited.inc((scope,))
+                return math.ceil(retry_after)
+        self.allowed += 1
+        return 0
+
+    async def reset(self, username: str) -> None:
+        # After a successful sign-in the user starts again with the full limit
+        key = f"rate:username:{username}"
+        try:
+            if self.redis is not None:
+                await self.redis.delete(key)
+            else:
+                self.buckets.delete(key)
+        except Exception as e:
+            self.errors += 1
+            self.log.logger.error(e)
+
+    def get_stats(self) -> dict:
+        stats = {
+            "backend": self.backend,
+            "allowed": self.allowed,
+            "limited_ip": self.limited["ip"],
+            "limited_username": self.limited["username"],
+            "errors": self.errors,
+        }
+        if self.redis is None:
+            stats.update({ "keys": len(self.buckets.entries), "max_keys": self.buckets.max_size, "evictions": self.buckets.evictions })
+        return stats
+
+    async def close(self) -> None:
+        await close_redis_client(self.redis)
@@ -0,0 +1,77 @@
+from datetime import datetime, timedelta, timezone
+from dependency_injector.wiring import Provide, inject
+from pymongo.asynchronous.database import AsyncDatabase
+from log2mongo import log2mongo
+from dotenv import load_dotenv
+import hashlib, os, secrets, uuid
+
+from src.dependency_injection.containers import Container
+
+log_service: log2mongo = Provide[Container.logging]
+load_dotenv()
+refresh_tokens_collection = str(os.environ["DB_REFRESH_TOKENS_COLLECTION"])
+refresh_token_expire = timedelta(days=int(os.environ["REFRESH_TOKEN_EXPIRE_DAYS"]))
+
+# Refresh tokens are opaque random values, only their digest is stored. Every rotation keeps the
+# family of the first token, so reusing an already rotated token revokes the whole family
+def get_token_id(token: str) -> str:
+    return hashlib.sha256(token.encode()).hexdigest()
+
+@inject
+async def issue_refresh_token(db: AsyncDatabase, email: str, family: str | None = None, log = log_service) -> str | None:
+    try:
+        token = secrets.token_urlsafe(32)
+        now = datetime.now(timezone.utc)
+        await db[refresh_tokens_collection].insert_one({
+            "_id": get_token_id(token),
+            "family": family if family is not None else uuid.uuid4().hex,
+            "email": email,
+            "created_at": now,
+            # TTL index, Mongo removes the document once it expires
+            "expires_at": now + refresh_token_expire,
+            "used_at": None,
+        })
+        return token
+    except Exception as e:
+        log.logger.error(e)
+
+@inject
+async def rotate_refresh_token(db: AsyncDatabase, token: str, log = log_service) -> tuple[str, str] | None:
+    try:
+        token_id = get_token_id(token)
+        now = datetime.now(timezone.utc)
+        # Marking the token as used is atomic, of two concurrent refreshes with the same token only one wins
+        current = await db[refresh_tokens_collection].find_one_and_update(
+            {"_id": token_id, "used_at": None, "expires_at": {"$gt": now}},
+            {"$set": {"used_at": now}})
+
+        if current is None:
+            if (reused := await db[refresh_tokens_collection].find_one({"_id": token_id, "used_at": {"$ne": None}})) is not None:
+                # A rotated token was presented again, it may have been stolen
+                result = await db[refresh_tokens_collection].delete_many({"family": reused["family"]})
+                log.logger.warning(f"Refresh token reused for { reused['email'] }, { result.deleted_count } tokens revoked")
+            return None
+
+        if (new_token := await issue_refresh_token(db, current["email"], current["family"])) is None:
+            return None
+        return current["email"], new_token
+    except Exception as e:
+        log.logger.error(e)
+
+@inject
+async def revoke_user_tokens(db: AsyncDatabase, email: str, log = log_service) -> int:
+    try:
+        return (await db[refresh_tokens_collection].delete_many({"email": email})).deleted_count
+    except Exception as e:
+        log.logger.error(e)
+    return 0
+
+@inject
+async def revoke_refresh_token(db: AsyncDatabase, token: str, email: str, log = log_service) -> int:
+    try:
+        # The token and every other token rotated from the same sign-in, only when it belongs to the user
+        if (current := await db[refresh_tokens_collection].find_one({"_id": get_token_id(token), "email": email})) is not None:
+            return (await db[refresh_tokens_collection].delete_many({"family": current["family"], "email": email})).deleted_count
+    except Exception as e:
+        log.logger.error(e)
+    return 0
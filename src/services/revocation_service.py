@@ -0,0 +1,107 @@
+from datetime import datetime, timedelta, timezone
+from log2mongo import log2mongo
+import asyncio, time
+
+from src.services.mongodb_service import MongoAsyncService
+from src.services.task_service import BackgroundTask
+
+def to_timestamp(value: datetime) -> float:
+    # Mongo returns naive UTC datetimes
+    return value.replace(tzinfo=timezone.utc).timestamp() if value.tzinfo is None else value.timestamp()
+
+class RevocationList(BackgroundTask):
+
+    def __init__(self, database: MongoAsyncService, collection: str, poll_seconds: int, token_lifetime_minutes: int, log: log2mongo) -> None:
+        self.database = database
+        self.collection = collection
+        self.poll_seconds = poll_seconds
+        self.token_lifetime = timedelta(minutes=token_lifetime_minutes)
+        self.log = log
+        # Every revocation still in force is kept in memory, verifying a token never waits for Mongo.
+        # Plain sets instead of a bloom filter, there are no false positives to confirm against the database
+        self.tokens: dict[str, float] = {}
+        self.users: dict[str, tuple[float, float]] = {}
+        self.last_seen: datetime | None = None
+        self.refreshes = 0
+        self.errors = 0
+
+    def is_revoked(self, payload: dict, email: str) -> bool:
+        if (jti := payload.get("jti")) is not None and jti in self.tokens:
+            return True
+        # iat has sub-second precision, a token issued right after the revocation is accepted. Tokens without iat predate it
+        if (user := self.users.get(email)) is not None and payload.get("iat", 0) < user[0]:
+            return True
+        return False
+
+    def apply(self, document: dict):
+        expires_at = to_timestamp(document["expires_at"])
+        if document["type"] == "user":
+            self.users[document["email"]] = (document["revoked_before"], expires_at)
+        else:
+            self.tokens[document["_id"]] = expires_at
+
+    def purge(self):
+        # Revocations are only needed until the tokens they cover expire
+        now = time.time()
+        self.tokens = { k: v for k, v in self.tokens.items() if v > now }
+        self.users = { k: v for k, v in self.users.items() if v[1] > now }
+
+    async def load(self):
+        # Only the revocations made since the last poll, with a margin for writes committed out of order
+        query = {} if self.last_seen is None else {"revoked_at": {"$gte": self.last_seen - timedelta(seconds=self.poll_seconds)}}
+        async for document in self.database.get_db()[self.collection].find(query):
+            self.apply(document)
+            if self.last_seen is None or document["revoked_at"] > self.last_seen:
+                self.last_seen = document["revoked_at"]
+        self.purge()
+        self.refreshes += 1
+
+    async def load_at_startup(self, attempts: int = 5):
+        # The application does not serve with an empty list, after the last attempt the error stops the startup
+        for attempt in range(1, attempts + 1):
+            try:
+                return await self.load()
+            except Exception as e:
+                self.errors += 1
+                self.log.logger.error(e)
+                if attempt == attempts:
+                    raise e
+                await asyncio.sleep(self.poll_seconds)
+
+    async def refresh(self):
+        # A failed poll keeps the revocations already loaded, the next poll tries again
+        try:
+            await self.load()
+        except Exception as e:
+            self.errors += 1
+            self.log.logger.error(e)
+
+    async def revoke_token(self, jti: str, exp: int):
+        expires_at = datetime.fromtimestamp(exp, timezone.utc)
+        await self.database.get_db()[self.collection].update_one(
+            {"_id": jti},
+            {"$setOnInsert": {"type": "token", "revoked_at": datetime.now(timezone.utc), "expires_at": expires_at}},
+            upsert = True)
+        self.tokens[jti] = expires_at.timestamp()
+
+    async def revoke_user(self, email: str):
+        # Every token of the user issued until now, kept until the last of them expires
+        now = datetime.now(timezone.utc)
+        document = {"type": "user", "email": email, "revoked_before": now.timestamp(), "revoked_at": now, "expires_at": now + self.token_lifetime}
+        await self.database.get_db()[self.collection].update_one({"_id": f"user:{email}"}, {"$set": document}, upsert = True)
+        self.apply(document)
+
+    def get_stats(self) -> dict:
+        return {
+            "tokens": len(self.tokens),
+            "users": len(self.users),
+            "refreshes": self.refreshes,
+            "errors": self.errors,
+            "last_seen": self.last_seen,
+        }
+
+    async def run(self):
+        # The first load is awaited at startup, see main.start
+        while True:
+            await asyncio.sleep(self.poll_seconds)
+            await self.refresh()
@@ -0,0 +1,66 @@
+from cryptography.hazmat.primitives import serialization
+from cryptography.hazmat.backends import default_backend
+from jwt.algorithms import get_default_algorithms
+from log2mongo import log2mongo
+import base64, hashlib, json
+
+# Members used to compute the RFC 7638 thumbprint of each key type
+THUMBPRINT_MEMBERS = {
+    "RSA": ("e", "kty", "n"),
+    "EC": ("crv", "kty", "x", "y"),
+    "OKP": ("crv", "kty", "x"),
+}
+
+class SigningKeyService:
+
+    def __init__(self, algorithm: str, signing_key_file: str, verification_key_files: list[str], log: log2mongo) -> None:
+        self.log = log
+        self.algorithm = algorithm
+        self.private_key = None
+        self.kid = None
+        self.public_keys = {}
+        self.jwks = {"keys": []}
+        self.jwks_json = b'{"keys":[]}'
+
+        # HS* tokens are signed with JWT_SECRET_KEY and there is nothing to publish
+        if self.is_symmetric():
+            return
+
+        try:
+            self.private_key = self.load_private_key(signing_key_file)
+            self.kid = self.add_public_key(self.private_key.public_key()) # type: ignore
+            # Keys that were rotated out, they only verify tokens issued before the rotation
+            for key_file in verification_key_files:
+                self.add_public_key(self.load_public_key(key_file))
+            self.jwks_json = json.dumps(self.jwks, separators=(",", ":")).encode()
+        except Exception as e:
+            self.log.logger.error(e)
+            print(f"Error loading signing keys: {e}")
+
+    def is_symmetric(self) -> bool:
+        return self.algorithm.startswith("HS")
+
+    def load_private_key(self, key_file: str):
+        with open(key_file, "rb") as f:
+            return serialization.load_pem_private_key(f.read(), password=None, backend=default_backend())
+
+    def load_public_key(self, key_file: str):
+        with open(key_file, "rb") as f:
+            return serialization.load_pem_public_key(f.read(), backend=default_backend())
+
+    def add_public_key(self, public_key) -> str:
+        jwk = get_default_algorithms()[self.algorithm].to_jwk(public_key, as_dict=True)
+        kid = self.get_thumbprint(jwk)
+        if kid not in self.public_keys:
+            self.public_keys[kid] = public_key
+            jwk.update({ "kid": kid, "alg": self.algorithm, "use": "sig" })
+            self.jwks["keys"].append(jwk)
+        return kid
+
+    def get_thumbprint(self, jwk: dict) -> str:
+        members = { k: jwk[k] for k in THUMBPRINT_MEMBERS[jwk["kty"]] }
+        digest = hashlib.sha256(json.dumps(members, separators=(",", ":"), sort_keys=True).encode()).digest()
+        return str(base64.urlsafe_b64encode(digest).rstrip(b"="), "utf8")
+
+    def get_public_key(self, kid: str | None):
+        return self.public_keys.get(kid)
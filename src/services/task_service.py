@@ -0,0 +1,21 @@
+import asyncio
+
+# A service that runs a loop in the background, the subclass implements run
+class BackgroundTask:
+
+    task: asyncio.Task | None = None
+
+    async def run(self):
+        raise NotImplementedError
+
+    def start(self):
+        self.task = asyncio.create_task(self.run())
+
+    async def stop(self):
+        if self.task is not None:
+            self.task.cancel()
+            try:
+                await self.task
+            except asyncio.CancelledError:
+                pass
+            self.task = None
@@ -0,0 +1,34 @@
+from concurrent.futures import ThreadPoolExecutor
+from PIL import Image, ImageOps
+from log2mongo import log2mongo
+import asyncio, io
+
+# Module level function so the work can be moved to a process pool if needed
+def create_variants(data: bytes, sizes: list[int]) -> dict[int, bytes]:
+    variants = {}
+    with Image.open(io.BytesIO(data)) as image:
+        # JPEG files can be decoded directly at a smaller scale
+        image.draft("RGB", (max(sizes), max(sizes)))
+        image = ImageOps.exif_transpose(image)
+        if image.mode not in ("RGB", "RGBA"):
+            image = image.convert("RGBA")
+        for size in sizes:
+            variant = image.copy()
+            variant.thumbnail((size, size))
+            output = io.BytesIO()
+            variant.save(output, "WEBP", quality=80)
+            variants[size] = output.getvalue()
+    return variants
+
+class ThumbnailService:
+
+    def __init__(self, sizes: list[int], workers: int, log: log2mongo) -> None:
+        self.sizes = sizes
+        self.log = log
+        self.executor = ThreadPoolExecutor(max_workers= workers, thread_name_prefix= "thumbnails")
+
+    async def create_variants(self, data: bytes) -> dict[int, bytes]:
+        return await asyncio.get_running_loop().run_in_executor(self.executor, create_variants, data, self.sizes)
+
+    def shutdown(self):
+        self.executor.shutdown(wait=False, cancel_futures=True)
@@ -1,46 +1,104 @@
 from datetime import datetime
 from typing import Optional, Union
+from src.services.cache_service import LRUCache, close_redis_client, create_redis_client
 from src.services.otp_service import OTP
-import time
+from src.services.tracing_service import traced
+import hashlib, hmac, time
 from log2mongo import log2mongo
 
 class TOTP(OTP):
 
-    def __init__(self, secret: str, digest: str, time_step: int, return_digits: int, log: log2mongo) -> None:
+    def __init__(self, secret: str, digest: str, time_step: int, return_digits: int, log: log2mongo, time_window: int = 1, key_cache_size: int = 1000, replay_backend: str = "memory", replay_redis_url: str = "") -> None:
         self.secret = secret
         self.digest = digest
         self.time_step = time_step
         self.return_digits = return_digits
+        self.time_window = time_window
         self.log = log
+        # Keyed HMAC per secret, the base32 decoding and the key setup are done once
+        self.hashers = LRUCache(key_cache_size)
+        # Codes already accepted, kept until they are out of the verification window
+        self.used_codes = LRUCache(100_000)
+        self.replay_backend = replay_backend
+        self.redis = create_redis_client(replay_redis_url) if replay_backend == "redis" else None
+        self.accepted = 0
+        self.rejected = 0
+        self.replayed = 0
         super().__init__()
 
+    def get_cached_hasher(self, secret: str, is_value_ascii: bool = False, is_value_hex: bool = False):
+        key = (secret, is_value_ascii, is_value_hex)
+        if (hasher := self.hashers.get(key)) is None:
+            hasher = self.get_hasher(self.to_bytes(secret, is_value_ascii, is_value_hex), self.digest)
+            self.hashers.set(key, hasher)
+        return hasher
+
+    @traced("totp.at")
     async def at(self, for_time: Union[int, datetime], secret: Optional[str] = None, time_window: int = 0, is_value_ascii: bool = False, is_value_hex: bool = False) -> str:
         otp = ""
         try:
             secret = secret if secret else self.secret
-            if isinstance(for_time, int):
-                for_time = self.to_unix_time(datetime.fromtimestamp(for_time))
-            otp = self.generate_OPT(secret, self.to_unix_time(for_time), self.return_digits, self.digest, is_value_ascii, is_value_hex)
+            # An int is a unix timestamp
+            counter = for_time // self.time_step if isinstance(for_time, int) else self.to_unix_time(for_time)
+            otp = self.generate_from_hasher(self.get_cached_hasher(secret, is_value_ascii, is_value_hex), counter, self.return_digits)
         except Exception as e:
             self.log.logger.error(e)
         return otp
-    
+
+    @traced("totp.now")
     async def now(self, secret: Optional[str] = None, is_value_ascii: bool = False, is_value_hex: bool = False) -> str:
-        print(f'ascii: {is_value_ascii}')
-        print(f'secret: {secret}')
-        return self.generate_OPT(secret if secret else self.secret, self.to_unix_time(datetime.now()), self.return_digits, self.digest, is_value_ascii, is_value_hex)
-    
-    async def verify(self, otp_to_validate: str, secret: Optional[str] = None, for_time: Optional[datetime] = None, time_window: int = 0, is_value_ascii: bool = False, is_value_hex: bool = False) -> bool:
+        hasher = self.get_cached_hasher(secret if secret else self.secret, is_value_ascii, is_value_hex)
+        return self.generate_from_hasher(hasher, self.to_unix_time(datetime.now()), self.return_digits)
+
+    @traced("totp.verify")
+    async def verify(self, otp_to_validate: str, secret: Optional[str] = None, for_time: Optional[datetime] = None, time_window: Optional[int] = None, is_value_ascii: bool = False, is_value_hex: bool = False) -> bool:
         result = False
         try:
             secret = self.secret if secret is None else secret
-            for_time = datetime.now() if for_time is None else for_time
-            otp = await self.at(for_time, secret, time_window, is_value_ascii, is_value_hex)
-            if otp_to_validate == otp:
+            time_window = self.time_window if time_window is None else time_window
+            counter = self.to_unix_time(datetime.now() if for_time is None else for_time)
+            hasher = self.get_cached_hasher(secret, is_value_ascii, is_value_hex)
+
+            # Every step of the window is checked with a constant time comparison, so the response time
+            # does not tell which step matched
+            matched = None
+            for step in range(counter - time_window, counter + time_window + 1):
+                if hmac.compare_digest(self.generate_from_hasher(hasher, step, self.return_digits), otp_to_validate):
+                    matched = step
+
+            if matched is None:
+                self.rejected += 1
+            elif await self.mark_used(secret, matched, time_window):
+                self.accepted += 1
                 result = True
+            else:
+                self.replayed += 1
         except Exception as e:
             self.log.logger.error(e)
         return result
-    
+
+    async def mark_used(self, secret: str, counter: int, time_window: int) -> bool:
+        # The secret itself is never stored, only a digest of it
+        key = f"totp:{hashlib.sha256(secret.encode()).hexdigest()}:{counter}"
+        ttl = (2 * time_window + 1) * self.time_step
+        if self.redis is not None:
+            return bool(await self.redis.set(key, 1, nx=True, ex=ttl))
+        if self.used_codes.get(key) is not None:
+            return False
+        self.used_codes.set(key, True, time.time() + ttl)
+        return True
+
+    def get_stats(self) -> dict:
+        return {
+            "accepted": self.accepted,
+            "rejected": self.rejected,
+            "replayed": self.replayed,
+            "replay_backend": self.replay_backend,
+            "keys": self.hashers.get_stats(),
+        }
+
+    async def close(self) -> None:
+        await close_redis_client(self.redis)
+
     def to_unix_time(self, date) -> int:
         return int(time.mktime(date.utctimetuple()) / self.time_step)
\ No newline at end of file
@@ -0,0 +1,77 @@
+from contextlib import nullcontext
+from dotenv import load_dotenv
+from pymongo import monitoring
+import functools, os
+
+load_dotenv()
+tracer = None
+
+# OpenTelemetry is optional, without TRACING_ENABLED nothing is imported and every helper is a no-op
+if os.environ["TRACING_ENABLED"] == "true":
+    from opentelemetry import propagate, trace
+    from opentelemetry.sdk.resources import Resource
+    from opentelemetry.sdk.trace import TracerProvider
+    from opentelemetry.sdk.trace.export import BatchSpanProcessor, ConsoleSpanExporter
+
+    def get_exporter():
+        exporter = os.environ["TRACING_EXPORTER"]
+        if exporter == "file":
+            return ConsoleSpanExporter(out=open(os.environ["TRACING_FILE"], "a"))
+        if exporter == "otlp":
+            from opentelemetry.exporter.otlp.proto.http.trace_exporter import OTLPSpanExporter
+            return OTLPSpanExporter()
+        return ConsoleSpanExporter()
+
+    provider = TracerProvider(resource=Resource.create({ "service.name": os.environ["TRACING_SERVICE_NAME"] }))
+    provider.add_span_processor(BatchSpanProcessor(get_exporter()))
+    trace.set_tracer_provider(provider)
+    tracer = trace.get_tracer(__name__)
+
+def traced(name: str):
+    def decorator(func):
+        if tracer is None:
+            return func
+
+        @functools.wraps(func)
+        async def wrapper(*args, **kwargs):
+            with tracer.start_as_current_span(name): # type: ignore
+                return await func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+def server_span(scope):
+    if tracer is None:
+        return nullcontext()
+    # The incoming traceparent header makes this request part of the caller's trace
+    carrier = { k.decode("latin-1"): v.decode("latin-1") for k, v in scope["headers"] }
+    return tracer.start_as_current_span(f"{scope['method']} {scope['path']}", context=propagate.extract(carrier), kind=trace.SpanKind.SERVER)
+
+def end_server_span(span, method: str, route: str, status_code: int):
+    if span is not None:
+        span.update_name(f"{method} {route}")
+        span.set_attribute("http.route", route)
+        span.set_attribute("http.status_code", status_code)
+
+class CommandTracing(monitoring.CommandListener):
+
+    def __init__(self) -> None:
+        self.spans = {}
+
+    def started(self, event):
+        # Listeners run in the task that sends the command, so the span is a child of the current one
+        self.spans[(event.request_id, event.connection_id)] = tracer.start_span( # type: ignore
+            f"mongo {event.command_name}",
+            kind=trace.SpanKind.CLIENT,
+            attributes={ "db.system": "mongodb", "db.name": event.database_name, "db.operation": event.command_name })
+
+    def succeeded(self, event):
+        if (span := self.spans.pop((event.request_id, event.connection_id), None)) is not None:
+            span.end()
+
+    def failed(self, event):
+        if (span := self.spans.pop((event.request_id, event.connection_id), None)) is not None:
+            span.set_status(trace.Status(trace.StatusCode.ERROR, str(event.failure)))
+            span.end()
+
+def get_command_listeners() -> list:
+    return [CommandTracing()] if tracer is not None else []
@@ -0,0 +1,112 @@
+from dependency_injector.wiring import Provide, inject
+from fastapi import HTTPException, status
+from pymongo.asynchronous.database import AsyncDatabase
+from urllib.parse import quote, urlencode
+from log2mongo import log2mongo
+from dotenv import load_dotenv
+import base64, os
+
+from src.models.totp_model import TwoFactorEnrollment
+from src.services.cache_service import LRUCache
+from src.services.crypto_service import CryptoService
+from src.services.totp_service import TOTP
+from src.services.user_cache_service import UserCache
+from src.dependency_injection.containers import Container
+
+crypto_service: CryptoService = Provide[Container.crypto_service]
+totp_service: TOTP = Provide[Container.totp]
+secret_cache_service: LRUCache = Provide[Container.twofactor_secrets]
+user_cache_service: UserCache = Provide[Container.user_cache]
+log_service: log2mongo = Provide[Container.logging]
+load_dotenv()
+users_collection = str(os.environ["DB_USERS_COLLECTION"])
+issuer = os.environ["TOTP_ISSUER"]
+
+# The secrets are stored RSA encrypted in the user document, they are not part of the User model
+# so they are never returned by the API or kept in the user cache
+def generate_secret() -> str:
+    return base64.b32encode(os.urandom(20)).decode()
+
+def get_otpauth_uri(email: str, secret: str, totp: TOTP) -> str:
+    query = urlencode({
+        "secret": secret,
+        "issuer": issuer,
+        "algorithm": totp.digest.upper(),
+        "digits": totp.return_digits,
+        "period": totp.time_step,
+    })
+    return f"otpauth://totp/{quote(issuer)}:{quote(email)}?{query}"
+
+@inject
+async def start_enrollment(db: AsyncDatabase, email: str, current_code: str | None = None, crypto = crypto_service, totp = totp_service, log = log_service) -> TwoFactorEnrollment | None:
+    try:
+        # Replacing an enabled secret needs a code of the current one, an access token alone can not move it to another device
+        user_db = await db[users_collection].find_one({"email": email}, {"twofactor_enabled": 1})
+        if user_db is None:
+            return None
+        if user_db.get("twofactor_enabled") and (current_code is None or not await verify_code(db, email, current_code)):
+            raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="A code of the current authenticator is required")
+
+        # The secret is pending until the user proves the authenticator app has it
+        secret = generate_secret()
+        update_op = {"$set": {"twofactor_pending_secret": await crypto.encrypt_text(secret)}}
+        if (await db[users_collection].update_one({"email": email}, update_op)).matched_count > 0:
+            return TwoFactorEnrollment(secret = secret, otpauth_uri = get_otpauth_uri(email, secret, totp))
+    except HTTPException as e:
+        raise e
+    except Exception as e:
+        log.logger.error(e)
+
+@inject
+async def confirm_enrollment(db: AsyncDatabase, email: str, code: str, crypto = crypto_service, totp = totp_service, secret_cache = secret_cache_service, user_cache = user_cache_service, log = log_service) -> bool:
+    result = False
+    try:
+        user_db = await db[users_collection].find_one({"email": email}, {"twofactor_pending_secret": 1})
+        if user_db is not None and (pending := user_db.get("twofactor_pending_secret")) is not None:
+            if await totp.verify(code, await crypto.decrypt_text(pending)):
+                update_op = {"$set": {"twofactor_secret": pending, "twofactor_enabled": True}, "$unset": {"twofactor_pending_secret": ""}}
+                result = (await db[users_collection].update_one({"email": email, "twofactor_pending_secret": pending}, update_op)).modified_count > 0
+                secret_cache.delete(email)
+                await user_cache.invalidate(email)
+    except Exception as e:
+        log.logger.error(e)
+    return result
+
+@inject
+async def disable(db: AsyncDatabase, email: str, code: str, secret_cache = secret_cache_service, user_cache = user_cache_service, log = log_service) -> bool:
+    result = False
+    try:
+        if await verify_code(db, email, code):
+            update_op = {"$set": {"twofactor_enabled": False}, "$unset": {"twofactor_secret": "", "twofactor_pending_secret": ""}}
+            result = (await db[users_collection].update_one({"email": email}, update_op)).modified_count > 0
+            secret_cache.delete(email)
+            await user_cache.invalidate(email)
+    except Exception as e:
+        log.logger.error(e)
+    return result
+
+@inject
+async def get_secret(db: AsyncDatabase, email: str, crypto = crypto_service, secret_cache = secret_cache_service) -> str | None:
+    # Decrypted secrets are cached for a short time, a sign-in does not need Mongo and RSA on every attempt.
+    # The cache is per process, other workers see a disabled or replaced secret once their entry expires
+    if (secret := secret_cache.get(email)) is not None:
+        return secret
+    user_db = await db[users_collection].find_one({"email": email}, {"twofactor_secret": 1})
+    if user_db is None or user_db.get("twofactor_secret") is None:
+        return None
+    secret = await crypto.decrypt_text(user_db["twofactor_secret"])
+    secret_cache.set(email, secret)
+    return secret
+
+@inject
+async def verify_code(db: AsyncDatabase, email: str, code: str, totp = totp_service, log = log_service) -> bool:
+    try:
+        if (secret := await get_secret(db, email)) is not None:
+            return await totp.verify(code, secret)
+    except Exception as e:
+        log.logger.error(e)
+    return False
+
+@inject
+async def get_secret_cache_stats(secret_cache = secret_cache_service):
+    return secret_cache.get_stats()
@@ -0,0 +1,91 @@
+from log2mongo import log2mongo
+import bson
+
+from src.models.user_model import User
+from src.services.cache_service import LRUCache, close_redis_client, create_redis_client
+
+class UserCache:
+
+    def __init__(self, backend: str, max_size: int, ttl: int, redis_url: str, log: log2mongo) -> None:
+        self.backend = backend
+        self.ttl = ttl
+        self.log = log
+        self.memory = LRUCache(max_size, ttl)
+        self.redis = create_redis_client(redis_url) if backend == "redis" else None
+        self.hits = 0
+        self.misses = 0
+        self.errors = 0
+
+    def is_enabled(self) -> bool:
+        return self.backend in ("memory", "redis")
+
+    def get_key(self, email: str) -> str:
+        return f"user:{email}"
+
+    # BSON keeps the ObjectId and datetime values, so the model is rebuilt exactly as from a Mongo document
+    def to_bson(self, user: User) -> bytes:
+        document = user.model_dump(by_alias=True)
+        document["_id"] = document.pop("id")
+        return bson.encode(document)
+
+    def from_bson(self, value: bytes) -> User:
+        return User(**bson.decode(value))
+
+    async def get(self, email: str) -> User | None:
+        if not self.is_enabled():
+            return None
+        user = None
+        try:
+            if self.redis is not None:
+                if (value := await self.redis.get(self.get_key(email))) is not None:
+                    user = self.from_bson(value)
+            else:
+                user = self.memory.get(email)
+        except Exception as e:
+            self.errors += 1
+            self.log.logger.error(e)
+
+        if user is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        # Callers get their own copy, so the cached model is never modified
+        return user.model_copy()
+
+    async def set(self, email: str, user: User) -> None:
+        if not self.is_enabled():
+            return
+        try:
+            if self.redis is not None:
+                await self.redis.set(self.get_key(email), self.to_bson(user), ex=self.ttl)
+            else:
+                self.memory.set(email, user.model_copy())
+        except Exception as e:
+            self.errors += 1
+            self.log.logger.error(e)
+
+    async def invalidate(self, email: str) -> None:
+        if not self.is_enabled():
+            return
+        try:
+            if self.redis is not None:
+                await self.redis.delete(self.get_key(email))
+            else:
+                self.memory.delete(email)
+        except Exception as e:
+            self.errors += 1
+            self.log.logger.error(e)
+
+    def get_stats(self) -> dict:
+        stats = {
+            "backend": self.backend,
+            "hits": self.hits,
+            "misses": self.misses,
+            "errors": self.errors,
+        }
+        if self.redis is None:
+            stats.update({ "size": len(self.memory.entries), "max_size": self.memory.max_size, "evictions": self.memory.evictions })
+        return stats
+
+    async def close(self) -> None:
+        await close_redis_client(self.redis)
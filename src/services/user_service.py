@@ -1,54 +1,136 @@
+from datetime import datetime
 from dependency_injector.wiring import Provide, inject
-from fastapi import UploadFile
+from fastapi import HTTPException, UploadFile, status
+from gridfs import AsyncGridFSBucket
 from pymongo.asynchronous.database import AsyncDatabase
-from bson import ObjectId, Binary
+from bson import Binary, ObjectId
+from pymongo import ASCENDING, ReturnDocument
+from pymongo.errors import DuplicateKeyError
 from log2mongo import log2mongo
 from dotenv import load_dotenv
-import os
+import hashlib, os
 
 from src.services.crypto_service import CryptoService
+from src.services.user_cache_service import UserCache
+from src.services.thumbnail_service import ThumbnailService
 from src.services.jwt_service import get_email
+from src.services.refresh_token_service import revoke_user_tokens
+from src.services.revocation_service import RevocationList
 from src.models.user_picture import UserPicture
 from src.models.user_model import User
 from src.models.address_model import Address
 from src.dependency_injection.containers import Container
 
 crypto_service: CryptoService = Provide[Container.crypto_service]
+user_cache_service: UserCache = Provide[Container.user_cache]
+thumbnail_service: ThumbnailService = Provide[Container.thumbnails]
+revocation_service: RevocationList = Provide[Container.revocations]
 log_service: log2mongo = Provide[Container.logging]
 load_dotenv()
 users_collection = str(os.environ["DB_USERS_COLLECTION"])
 users_pics_collection = str(os.environ["DB_USERS_PICTURES_COLLECTION"])
+picture_max_size = int(os.environ["USER_PICTURE_MAX_BYTES"])
+picture_chunk_size = 255 * 1024
 
 @inject
-async def get_user(email: str, db: AsyncDatabase, log = log_service) -> User | None:
+async def get_user(email: str, db: AsyncDatabase, fresh: bool = False, cache = user_cache_service, log = log_service) -> User | None:
     try:
+        # The cache is per worker unless it is shared with Redis, the sign-in paths read the password,
+        # disabled and twofactor_enabled fields with fresh = True, straight from Mongo
+        if not fresh and (user := await cache.get(email)) is not None:
+            return user
         user_db = await db[users_collection].find_one({'email': email})
         if user_db is not None:
-            return User(**user_db)
+            user = User(**user_db)
+            await cache.set(email, user)
+            return user
         else:
             return None
     except Exception as e:
         log.logger.error(e)
 
 @inject
-async def get_user_picture(email: str, db: AsyncDatabase, log = log_service) -> UserPicture | None:
+async def get_user_picture(email: str, db: AsyncDatabase, size: int | None = None, thumbnails = thumbnail_service, log = log_service) -> UserPicture | None:
     try:
-        user_db = await db[users_collection].find_one({'email': email})
-        if user_db is not None:
-            user_picture = await db[users_pics_collection].find_one({'_id': user_db["_id"]})
-            if user_db is not None:
+        user = await get_user(email, db)
+        if user is not None:
+            # Only the requested variant is read from the document
+            projection = {"variants": 0} if size is None else { f"variants.{x}": 0 for x in thumbnails.sizes if x != size } or None
+            user_picture = await db[users_pics_collection].find_one({'_id': user.id}, projection)
+            if user_picture is not None:
                 return UserPicture.model_validate(user_picture)
         return None
     except Exception as e:
         log.logger.error(e)
+
+def get_pictures_bucket(db: AsyncDatabase) -> AsyncGridFSBucket:
+    # The files and chunks are stored in "<pictures collection>.files" and "<pictures collection>.chunks"
+    return AsyncGridFSBucket(db, bucket_name = users_pics_collection, chunk_size_bytes = picture_chunk_size)
+
+async def upload_picture(db: AsyncDatabase, user_id: ObjectId, file: UploadFile, content_type: str | None):
+    digest = hashlib.sha256()
+    length = 0
+    grid_in = get_pictures_bucket(db).open_upload_stream(str(user_id), metadata = {"user_id": user_id, "content_type": content_type})
+    try:
+        # The file is copied chunk by chunk, the size limit is checked before each chunk is written
+        while chunk := await file.read(picture_chunk_size):
+            length += len(chunk)
+            if length > picture_max_size:
+                raise HTTPException(status_code = status.HTTP_413_REQUEST_ENTITY_TOO_LARGE, detail = "Picture is too large")
+            digest.update(chunk)
+            await grid_in.write(chunk)
+        await grid_in.close()
+    except BaseException as e:
+        await grid_in.abort()
+        raise e
+    return grid_in._id, digest.hexdigest(), length
+
+@inject
+async def add_picture_variants(email: str, db: AsyncDatabase, thumbnails = thumbnail_service, log = log_service) -> bool:
+    result = False
+    try:
+        if not thumbnails.sizes or (user := await get_user(email, db)) is None:
+            return result
+        # Only the fields needed to read the GridFS file, not the picture document with its variants
+        user_picture = await db[users_pics_collection].find_one({"_id": user.id}, {"file_id": 1, "chunk_size": 1, "length": 1})
+        if user_picture is not None and user_picture.get("file_id") is not None:
+            file_id = user_picture["file_id"]
+            data = b"".join([x async for x in read_picture(db, file_id, user_picture.get("chunk_size") or picture_chunk_size, 0, (user_picture.get("length") or 0) - 1)])
+            variants = {
+                str(size): { "content_type": "image/webp", "etag": hashlib.sha256(variant).hexdigest(), "length": len(variant), "picture": Binary(variant) }
+                for size, variant in (await thumbnails.create_variants(data)).items()
+            }
+            # Skipped when the picture was replaced while the variants were being generated
+            update_result = await db[users_pics_collection].update_one({"_id": user.id, "file_id": file_id}, {"$set": {"variants": variants}})
+            result = update_result.modified_count > 0
+    except Exception as e:
+        log.logger.error(e)
+    return result
+
+async def read_picture(db: AsyncDatabase, file_id: ObjectId, chunk_size: int, start: int, end: int):
+    # Only the chunks that contain the requested bytes are read
+    query = {"files_id": file_id, "n": {"$gte": start // chunk_size, "$lte": end // chunk_size}}
+    async for chunk in db[f"{users_pics_collection}.chunks"].find(query, {"n": 1, "data": 1}).sort("n", ASCENDING):
+        offset = chunk["n"] * chunk_size
+        yield bytes(chunk["data"][max(start - offset, 0) : end - offset + 1])
     
+async def iterate_users(db: AsyncDatabase, after: str | None = None, limit: int = 100, fields: list[str] | None = None):
+    # Keyset pagination on _id, documents are validated one by one as they arrive from the cursor
+    query = {"_id": {"$gt": ObjectId(after)}} if after else {}
+    projection = { field: 1 for field in fields } if fields else None
+    async for user_db in db[users_collection].find(query, projection).sort("_id", ASCENDING).limit(limit):
+        # A projected document is not a complete user, it is returned as it is
+        if fields:
+            user_db["id"] = user_db.pop("_id")
+            yield user_db
+        else:
+            yield User(**user_db)
+
 @inject
-async def get_users(db: AsyncDatabase, log = log_service) -> list[User] | None:
+async def get_users(db: AsyncDatabase, after: str | None = None, limit: int = 100, fields: list[str] | None = None, log = log_service) -> list[User | dict] | None:
     try:
         users = list()
-        if (users_db := await db[users_collection].find({}).to_list()) is not None:
-            users = [User(**x) for x in users_db]
-            return users
+        users = [x async for x in iterate_users(db, after, limit, fields)]
     except Exception as e:
         log.logger.error(e)
     finally:
@@ -56,73 +138,77 @@ async def get_users(db: AsyncDatabase, log = log_service) -> list[User] | None:
     
 @inject
 async def add_user_picture(email: str, db: AsyncDatabase, file: UploadFile | None = None, pic_url: str | None = None, content_type: str | None = None, log = log_service) -> bool:
+    result = False
     try:
-        result = False
-        user_bd = await db[users_collection].find_one({'email': email})
-
-        if user_bd:
-            user_picture = await db[users_pics_collection].find_one({'_id': user_bd["_id"]})
-            user_pic = UserPicture(
-                id = user_bd["_id"]
-            )
+        user = await get_user(email, db)
 
+        if user:
+            update_op = None
             if file:
-                content_type = content_type
-                img = await file.read()
-                                
-                if user_picture is not None:
-                    query_filter = {"_id": user_bd["_id"]}
-                    update_op = {"$set" : {"picture" : Binary(img), "content_type": content_type, "picture_url": "" }}
-                    op_result = await db[users_pics_collection].update_one(query_filter, update_op)
-                    
-                    if op_result.modified_count > 0:
-                        result = True
-                else:
-                    user_pic.picture = Binary(img)
-                    op_result = await db[users_pics_collection].insert_one(user_pic.model_dump(by_alias=True))
-                    
-                    if op_result.inserted_id is not None:
-                        result = True
+                file_id, etag, length = await upload_picture(db, user.id, file, content_type) # type: ignore
+                update_op = {"$set" : {"file_id": file_id, "etag": etag, "length": length, "chunk_size": picture_chunk_size, "content_type": content_type, "picture": None, "picture_url": "", "variants": None, "updated_at": datetime.now() }}
             elif pic_url:
-                if user_picture is not None:
-                    query_filter = {"_id": user_bd["_id"]}
-                    update_op = {"$set" : {"picture_url" : pic_url, "content_type": 'text/plain', "picture": None }}
-                    op_result = await db[users_pics_collection].update_one(query_filter, update_op)
-                    
-                    if op_result.modified_count > 0:
-                        result = True
-                else:
-                    user_pic.picture_url = pic_url
-                    op_result = await db[users_pics_collection].insert_one(user_pic.model_dump(by_alias=True))
-                    
-                    if op_result.inserted_id is not None:
-                        result = True
+                update_op = {"$set" : {"picture_url" : pic_url, "content_type": 'text/plain', "picture": None, "file_id": None, "etag": None, "length": None, "variants": None, "updated_at": datetime.now() }}
+
+            if update_op:
+                update_op.update({ "$setOnInsert": { "created_at": datetime.now() } })
+                previous = await db[users_pics_collection].find_one_and_update({"_id": user.id}, update_op, {"file_id": 1}, upsert = True)
+                # The replaced file is removed after the document points to the new one
+                if previous and previous.get("file_id"):
+                    await get_pictures_bucket(db).delete(previous["file_id"])
+                result = True
 
+    except HTTPException as e:
+        raise e
     except Exception as e:
         log.logger.error(e)
-    finally:
-        return result
+    return result
     
 @inject
 async def create_user(db: AsyncDatabase, user: User, crypto = crypto_service, log = log_service) -> User | None:
     try:
-        user_bd = await db[users_collection].find_one({'email': user.email})
-        if user_bd == None:
-            user.password = await crypto.get_psw_hash(user.password)
-            result = await db[users_collection].insert_one(user.model_dump(exclude={"id"}))
-            us = await db[users_collection].find_one({ '_id': result.inserted_id })
-            user = User.model_validate(us)
-            return user
-        else:
-            return None
+        # Upsert with $setOnInsert, an existing email is detected even when the unique index is not built yet,
+        # the DuplicateKeyError of concurrent inserts is handled by upsert_user
+        created_user, created = await upsert_user(db, user)
+        return created_user if created else None
+    except HTTPException as e:
+        raise e
+    except Exception as e:
+        log.logger.error(e)
+
+@inject
+async def upsert_user(db: AsyncDatabase, user: User, crypto = crypto_service, log = log_service) -> tuple[User | None, bool]:
+    try:
+        # An existing email is found before bcrypt, a sign-up with a taken email does not use a password worker
+        if await db[users_collection].find_one({"email": user.email}, {"_id": 1}) is not None:
+            return await get_user(user.email, db, fresh = True), False
+        # The upsert only creates the user when the email still does not exist,
+        # the generated _id tells if the returned document is the new one
+        user_db = user.model_dump(exclude={"id"})
+        user_db["password"] = await crypto.get_psw_hash(user.password)
+        user_db["_id"] = ObjectId()
+        try:
+            result = await db[users_collection].find_one_and_update({"email": user.email}, {"$setOnInsert": user_db}, upsert = True, return_document = ReturnDocument.AFTER)
+        except DuplicateKeyError:
+            # Another request inserted the same email at the same time
+            result = await db[users_collection].find_one({"email": user.email})
+        if result is None:
+            return None, False
+        return User(**result), result["_id"] == user_db["_id"]
+    except HTTPException as e:
+        raise e
     except Exception as e:
         log.logger.error(e)
+    return None, False
 
 @inject
-async def deleted_user(db: AsyncDatabase, email: str, log = log_service) -> bool:
+async def deleted_user(db: AsyncDatabase, email: str, cache = user_cache_service, revocations = revocation_service, log = log_service) -> bool:
     try:
         result = False
         operation_result = await db[users_collection].delete_one({'email': email})
+        await cache.invalidate(email)
+        await revoke_user_tokens(db, email)
+        await revocations.revoke_user(email)
 
         if operation_result.deleted_count > 0:
             result = True
@@ -133,18 +219,17 @@ async def deleted_user(db: AsyncDatabase, email: str, log = log_service) -> bool
         return result
 
 @inject
-async def disabled_user(db: AsyncDatabase, email: str, log = log_service) -> bool:
+async def disabled_user(db: AsyncDatabase, email: str, cache = user_cache_service, revocations = revocation_service, log = log_service) -> bool:
     try:
         result = False
-        user_db = await db[users_collection].find_one({'email': email})
-
-        if user_db != None:
-            query_filter = {"email": email}
-            update_op = {"$set" : {"disabled" : False }}
-            op_result = await db[users_collection].update_one(query_filter, update_op)
-            
-            if op_result.modified_count > 0:
-                result = True
+        query_filter = {"email": email}
+        update_op = {"$set" : {"disabled" : True }}
+        op_result = await db[users_collection].update_one(query_filter, update_op)
+        await cache.invalidate(email)
+        
+        if op_result.modified_count > 0:
+            result = True
+            await revocations.revoke_user(email)
             
     except Exception as e:
         log.logger.error(e)
@@ -152,7 +237,7 @@ async def disabled_user(db: AsyncDatabase, email: str, log = log_service) -> boo
         return result
 
 @inject
-async def update_user(db: AsyncDatabase, model: User, log = log_service) -> User | None:
+async def update_user(db: AsyncDatabase, model: User, cache = user_cache_service, log = log_service) -> User | None:
     try:
         user_db = await db[users_collection].find_one({'email': model.email})
         user = None
@@ -168,6 +253,7 @@ async def update_user(db: AsyncDatabase, model: User, log = log_service) -> User
                     
                 if update_fields:
                     update_result = await db[users_collection].update_one({'_id': ObjectId(model.id)}, { "$set": update_fields })
+                    await cache.invalidate(model.email)
                     if update_result.modified_count > 0:
                         user = User(**user_db)
     except Exception as e:
@@ -188,39 +274,42 @@ async def get_user_by_token(db: AsyncDatabase, token: str, log = log_service) ->
         log.logger.error(e)
     
 @inject
-async def change_password(db: AsyncDatabase, email: str, new_password: str, crypto = crypto_service, log = log_service) -> bool:
+async def change_password(db: AsyncDatabase, email: str, new_password: str, crypto = crypto_service, cache = user_cache_service, revocations = revocation_service, log = log_service) -> bool:
+    result = False
     try:
-        result = False
-        user_db = await db[users_collection].find_one({'email': email})
+        # bcrypt is only paid for existing users
+        if await get_user(email, db) is None:
+            return result
+        query_filter = {"email": email}
+        update_op = {"$set" : {"password" : await crypto.get_psw_hash(new_password) }}
 
-        if user_db != None:
-            query_filter = {"email": email}
-            update_op = {"$set" : {"password" : await crypto.get_psw_hash(new_password) }}
-
-            if (await db[users_collection].update_one(query_filter, update_op)).modified_count > 0:
-                result = True
+        if (await db[users_collection].update_one(query_filter, update_op)).modified_count > 0:
+            result = True
+            # Sessions opened with the old password can not be renewed nor used
+            await revoke_user_tokens(db, email)
+            await revocations.revoke_user(email)
+        await cache.invalidate(email)
                 
+    except HTTPException as e:
+        raise e
     except Exception as e:
         log.logger.error(e)
-    finally:
-        return result
+    return result
     
 @inject
-async def insert_address(email: str, address: Address, db: AsyncDatabase, log = log_service) -> Address | None:
+async def insert_address(email: str, address: Address, db: AsyncDatabase, cache = user_cache_service, log = log_service) -> Address | None:
     try:
         result = None
-        user_db = await db[users_collection].find_one({'email': email})
+        query_filter = {"email": email}
+        new_address = address.model_dump()
+        id = new_address.pop("id")
+        new_address.update({ "_id": id })
+        update_op = {"$push" : {"address" : new_address }}
+        updated_result = await db[users_collection].update_one(query_filter, update_op)
+        await cache.invalidate(email)
 
-        if user_db is not None:
-            query_filter = {"email": email}
-            new_address = address.model_dump()
-            id = new_address.pop("id")
-            new_address.update({ "_id": id })
-            update_op = {"$push" : {"address" : new_address }}
-            updated_result = await db[users_collection].update_one(query_filter, update_op)
-
-            if updated_result.modified_count > 0:
-                result = address
+        if updated_result.modified_count > 0:
+            result = address
 
     except Exception as e:
         log.logger.error(e)
@@ -242,7 +331,7 @@ async def get_address(db: AsyncDatabase, email: str, log = log_service) -> list[
         return addresses
     
 @inject
-async def update_address(db: AsyncDatabase, email: str, address: Address, log = log_service) -> bool:
+async def update_address(db: AsyncDatabase, email: str, address: Address, cache = user_cache_service, log = log_service) -> bool:
     try:
         result = False
         updated_address = address.model_dump()
@@ -253,6 +342,7 @@ async def update_address(db: AsyncDatabase, email: str, address: Address, log =
         update_op = {"$set" : {"address.$[elem]" : address.model_dump() }}
         array_filter = [{"elem._id": address.id}]
         updated_result = await db[users_collection].update_one(query_filter, update_op, array_filters = array_filter)
+        await cache.invalidate(email)
         
         if updated_result.matched_count > 0 or updated_result.modified_count > 0:
             result = True
@@ -263,18 +353,16 @@ async def update_address(db: AsyncDatabase, email: str, address: Address, log =
         return result
     
 @inject
-async def change_status(status: bool, email: str, db: AsyncDatabase, log = log_service) -> bool:
+async def change_status(status: bool, email: str, db: AsyncDatabase, cache = user_cache_service, log = log_service) -> bool:
     result = False
     try:
-        user_db = await db[users_collection].find_one({'email': email})
-
-        if user_db != None:
-            query_filter = {"email": email}
-            update_op = {"$set" : {"online" : status }}
-            op_result = await db[users_collection].update_one(query_filter, update_op)
-            
-            if op_result.modified_count > 0:
-                result = True
+        query_filter = {"email": email}
+        update_op = {"$set" : {"online" : status }}
+        op_result = await db[users_collection].update_one(query_filter, update_op)
+        await cache.invalidate(email)
+        
+        if op_result.modified_count > 0:
+            result = True
 
     except Exception as e:
         log.logger.error(e)
@@ -0,0 +1,15 @@
+import logging, os, sys, types
+
+# Set before the services are imported, load_dotenv does not override existing variables
+os.environ["GOOGLE_OAUTH_CLIENT"] = "test-client.apps.googleusercontent.com"
+os.environ["GOOGLE_OAUTH_SECRET"] = "test-secret"
+os.environ["GOOGLE_OAUTH_TOKEN_URI"] = "https://oauth.test/token"
+os.environ["GOOGLE_OAUTH_REDIRECT_RESPONSE"] = "https://127.0.0.1:8000/auth/google-response"
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import pytest
+
+@pytest.fixture
+def log():
+    # The services only use log.logger, the standard logger takes the place of log2mongo
+    return types.SimpleNamespace(logger = logging.getLogger("tests"))
@@ -0,0 +1,57 @@
+from datetime import datetime, timedelta, timezone
+from cryptography.hazmat.primitives.asymmetric import rsa
+from jwt.algorithms import RSAAlgorithm
+import asyncio, json, jwt, pytest
+
+from src.services.google_jwks_service import GoogleJWKS
+from src.services.oauth_google_service import verify_id_token
+
+CLIENT_ID = "test-client.apps.googleusercontent.com"
+
+def create_key():
+    return rsa.generate_private_key(public_exponent = 65537, key_size = 2048)
+
+def create_id_token(key, kid: str = "test-key", **claims) -> str:
+    now = datetime.now(timezone.utc)
+    payload = { "iss": "https://accounts.google.com", "aud": CLIENT_ID, "sub": "1234", "email": "user@example.com", "iat": now, "exp": now + timedelta(minutes=5) }
+    payload.update(claims)
+    return jwt.encode(payload, key, algorithm = "RS256", headers = { "kid": kid })
+
+@pytest.fixture
+def key():
+    return create_key()
+
+@pytest.fixture
+def jwks(tmp_path, key, log):
+    # Local key set in the format of https://www.googleapis.com/oauth2/v3/certs
+    jwk = json.loads(RSAAlgorithm.to_jwk(key.public_key()))
+    jwk.update({ "kid": "test-key", "alg": "RS256", "use": "sig" })
+    jwks_file = tmp_path / "jwks.json"
+    jwks_file.write_text(json.dumps({ "keys": [jwk] }))
+    google_jwks = GoogleJWKS("", str(jwks_file), 3600, None, log) # type: ignore
+    asyncio.run(google_jwks.refresh())
+    return google_jwks
+
+def test_verify_id_token(jwks, key):
+    claims = asyncio.run(verify_id_token(create_id_token(key), jwks = jwks))
+    assert claims["email"] == "user@example.com"
+
+def test_verify_id_token_wrong_audience(jwks, key):
+    with pytest.raises(jwt.InvalidAudienceError):
+        asyncio.run(verify_id_token(create_id_token(key, aud = "another-client"), jwks = jwks))
+
+def test_verify_id_token_wrong_issuer(jwks, key):
+    with pytest.raises(jwt.InvalidIssuerError):
+        asyncio.run(verify_id_token(create_id_token(key, iss = "https://issuer.test"), jwks = jwks))
+
+def test_verify_id_token_expired(jwks, key):
+    with pytest.raises(jwt.ExpiredSignatureError):
+        asyncio.run(verify_id_token(create_id_token(key, exp = datetime.now(timezone.utc) - timedelta(minutes=1)), jwks = jwks))
+
+def test_verify_id_token_unknown_key(jwks, key):
+    with pytest.raises(jwt.InvalidTokenError):
+        asyncio.run(verify_id_token(create_id_token(key, kid = "unknown-key"), jwks = jwks))
+
+def test_verify_id_token_wrong_signature(jwks):
+    with pytest.raises(jwt.InvalidSignatureError):
+        asyncio.run(verify_id_token(create_id_token(create_key()), jwks = jwks))
@@ -0,0 +1,35 @@
+from urllib.parse import parse_qs
+import asyncio, httpx
+
+from src.services.oauth_google_service import get_auth_response
+
+CLIENT_ID = "test-client.apps.googleusercontent.com"
+TOKEN_URI = "https://oauth.test/token"
+REDIRECT_URI = "https://127.0.0.1:8000/auth/google-response"
+
+def token_endpoint(request: httpx.Request) -> httpx.Response:
+    # Local stand-in of Google's token endpoint
+    form = parse_qs(request.content.decode())
+    if str(request.url) != TOKEN_URI or form.get("code") != ["auth-code"]:
+        return httpx.Response(400, json = { "error": "invalid_grant" })
+    assert form["grant_type"] == ["authorization_code"]
+    assert form["client_id"] == [CLIENT_ID]
+    assert form["redirect_uri"] == [REDIRECT_URI]
+    return httpx.Response(200, json = { "access_token": "access", "id_token": "id-token", "scope": "openid email", "token_type": "Bearer", "expires_in": 3600 })
+
+async def exchange(url: str, log):
+    async with httpx.AsyncClient(transport = httpx.MockTransport(token_endpoint)) as http_client:
+        return await get_auth_response(url, http_client = http_client, log = log)
+
+def test_get_auth_response(log):
+    credentials = asyncio.run(exchange(f"{REDIRECT_URI}?state=abc&code=auth-code", log))
+    assert credentials is not None
+    assert credentials.token == "access"
+    assert credentials.id_token == "id-token"
+    assert credentials.scopes == ["openid", "email"]
+
+def test_get_auth_response_rejected_code(log):
+    assert asyncio.run(exchange(f"{REDIRECT_URI}?state=abc&code=wrong-code", log)) is None
+
+def test_get_auth_response_without_code(log):
+    assert asyncio.run(exchange(f"{REDIRECT_URI}?error=access_denied", log)) is None
@@ -0,0 +1,31 @@
+import asyncio, pytest
+
+from src.services.rate_limit_service import RateLimiter
+
+@pytest.fixture
+def limiter(log):
+    return RateLimiter("memory", 3, 60, 2, 300, 100, "", log)
+
+def test_username_limit(limiter):
+    assert asyncio.run(limiter.acquire("10.0.0.1", "user@example.com")) == 0
+    assert asyncio.run(limiter.acquire("10.0.0.2", "user@example.com")) == 0
+    # The third attempt comes from another IP, the username bucket is empty
+    assert asyncio.run(limiter.acquire("10.0.0.3", "user@example.com")) > 0
+    assert limiter.limited["username"] == 1
+
+def test_ip_limit(limiter):
+    for x in range(3):
+        assert asyncio.run(limiter.acquire("10.0.0.1", f"user{x}@example.com")) == 0
+    assert asyncio.run(limiter.acquire("10.0.0.1", "user3@example.com")) > 0
+    assert limiter.limited["ip"] == 1
+
+def test_reset(limiter):
+    for _ in range(2):
+        asyncio.run(limiter.acquire("10.0.0.1", "user@example.com"))
+    asyncio.run(limiter.reset("user@example.com"))
+    assert asyncio.run(limiter.acquire("10.0.0.1", "user@example.com")) == 0
+
+def test_disabled(log):
+    limiter = RateLimiter("none", 1, 60, 1, 300, 100, "", log)
+    for _ in range(5):
+        assert asyncio.run(limiter.acquire("10.0.0.1", "user@example.com")) == 0
@@ -0,0 +1,40 @@
+from datetime import datetime, timedelta, timezone
+import asyncio, pytest, time
+
+from src.services.revocation_service import RevocationList
+
+class UnavailableDatabase:
+
+    def get_db(self):
+        raise ConnectionError("Mongo is not reachable")
+
+@pytest.fixture
+def revocations(log):
+    return RevocationList(UnavailableDatabase(), "revoked_tokens", 0, 60, log) # type: ignore
+
+def test_revoked_token(revocations):
+    revocations.apply({ "_id": "jti-1", "type": "token", "expires_at": datetime.now(timezone.utc) + timedelta(minutes=5) })
+    assert revocations.is_revoked({ "jti": "jti-1" }, "user@example.com")
+    assert not revocations.is_revoked({ "jti": "jti-2" }, "user@example.com")
+
+def test_revoked_user(revocations):
+    now = time.time()
+    revocations.apply({ "type": "user", "email": "user@example.com", "revoked_before": now, "expires_at": datetime.now(timezone.utc) + timedelta(minutes=60) })
+    assert revocations.is_revoked({ "iat": now - 0.5 }, "user@example.com")
+    # A token issued in the same second but after the revocation is accepted
+    assert not revocations.is_revoked({ "iat": now + 0.001 }, "user@example.com")
+    assert not revocations.is_revoked({ "iat": now - 0.5 }, "other@example.com")
+
+def test_purge(revocations):
+    revocations.apply({ "_id": "jti-1", "type": "token", "expires_at": datetime.now(timezone.utc) - timedelta(seconds=1) })
+    revocations.purge()
+    assert not revocations.is_revoked({ "jti": "jti-1" }, "user@example.com")
+
+def test_startup_load_fails(revocations):
+    with pytest.raises(ConnectionError):
+        asyncio.run(revocations.load_at_startup(attempts = 2))
+    assert revocations.errors == 2
+
+def test_poll_failure_is_counted(revocations):
+    asyncio.run(revocations.refresh())
+    assert (revocations.errors, revocations.refreshes) == (1, 0)
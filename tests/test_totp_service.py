@@ -0,0 +1,31 @@
+from datetime import datetime, timedelta
+import asyncio, pytest
+
+from src.services.totp_service import TOTP
+
+# RFC 6238 test secret "12345678901234567890" in base32
+SECRET = "GEZDGNBVGY3TQOJQGEZDGNBVGY3TQOJQ"
+
+@pytest.fixture
+def totp(log):
+    return TOTP(SECRET, "sha1", 30, 8, log, time_window = 1)
+
+def test_rfc6238_vector(totp):
+    assert totp.generate_from_hasher(totp.get_cached_hasher(SECRET), 59 // 30, 8) == "94287082"
+
+def test_verify_accepts_a_code_once(totp):
+    code = asyncio.run(totp.now())
+    assert asyncio.run(totp.verify(code))
+    assert not asyncio.run(totp.verify(code))
+    assert (totp.accepted, totp.replayed) == (1, 1)
+
+def test_verify_window(totp):
+    code = asyncio.run(totp.now())
+    # One step of drift is accepted, three are not
+    assert not asyncio.run(totp.verify(code, for_time = datetime.now() + timedelta(seconds = 90)))
+    assert asyncio.run(totp.verify(code, for_time = datetime.now() + timedelta(seconds = 30)))
+
+def test_verify_rejects_an_invalid_code(totp):
+    code = asyncio.run(totp.now())
+    assert not asyncio.run(totp.verify("0" * 8 if code != "0" * 8 else "1" * 8))
+    assert totp.rejected == 1